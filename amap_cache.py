@@ -0,0 +1,98 @@
+# amap_cache.py
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import AMAP_CACHE_FILE, GEOCODE_CACHE_TTL_SECONDS, DRIVING_TIME_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+RouteKey = Tuple[float, float, float, float]
+
+
+class AmapDiskCache:
+    """
+    基于 SQLite 的高德查询结果缓存，跨进程/跨会话复用。
+    geocode 表按 (城市, 地址) 存坐标；route 表按四舍五入后的起终点坐标存驾车耗时。
+    只写入成功结果，失败的查询下次仍会重新请求。
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        # 地理编码与驾车时间均在线程池中并发查询，共用同一个连接并由锁串行化访问
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                "city TEXT NOT NULL, address TEXT NOT NULL, lat REAL NOT NULL, lon REAL NOT NULL, ts REAL NOT NULL, "
+                "PRIMARY KEY (city, address))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS route ("
+                "origin_lat REAL NOT NULL, origin_lon REAL NOT NULL, dest_lat REAL NOT NULL, dest_lon REAL NOT NULL, "
+                "minutes REAL NOT NULL, ts REAL NOT NULL, "
+                "PRIMARY KEY (origin_lat, origin_lon, dest_lat, dest_lon))"
+            )
+            self._conn.commit()
+
+    def get_geocode(self, address: str, city: str) -> Optional[Tuple[Dict[str, float], float]]:
+        """读取未过期的坐标，返回 (坐标, 写入时间戳)，未命中返回 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lon, ts FROM geocode WHERE city = ? AND address = ?", (city, address)
+            ).fetchone()
+        if row is None or time.time() - row[2] >= GEOCODE_CACHE_TTL_SECONDS:
+            return None
+        return {"lat": row[0], "lon": row[1]}, row[2]
+
+    def put_geocodes(self, entries: List[Tuple[Tuple[str, str], Dict[str, float]]]) -> None:
+        """批量写入 ((address, city), 坐标)，一次事务提交。"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO geocode (city, address, lat, lon, ts) VALUES (?, ?, ?, ?, ?)",
+                [(city, address, coords['lat'], coords['lon'], now) for (address, city), coords in entries]
+            )
+            self._conn.commit()
+
+    def get_route(self, key: RouteKey) -> Optional[Tuple[float, float]]:
+        """读取未过期的驾车耗时，返回 (分钟, 写入时间戳)，未命中返回 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT minutes, ts FROM route WHERE origin_lat = ? AND origin_lon = ? AND dest_lat = ? AND dest_lon = ?",
+                key
+            ).fetchone()
+        if row is None or time.time() - row[1] >= DRIVING_TIME_CACHE_TTL_SECONDS:
+            return None
+        return row[0], row[1]
+
+    def put_route(self, key: RouteKey, minutes: float) -> None:
+        """写入（或覆盖）一条驾车耗时。"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO route (origin_lat, origin_lon, dest_lat, dest_lon, minutes, ts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, minutes, time.time())
+            )
+            self._conn.commit()
+
+
+_CACHE: Optional[AmapDiskCache] = None
+_CACHE_INIT_LOCK = threading.Lock()
+_CACHE_DISABLED = False
+
+
+def get_amap_cache() -> Optional[AmapDiskCache]:
+    """懒加载全局缓存实例；数据库不可用时返回 None，查询将直接穿透到高德 API。"""
+    global _CACHE, _CACHE_DISABLED
+    if _CACHE is None and not _CACHE_DISABLED:
+        with _CACHE_INIT_LOCK:
+            if _CACHE is None and not _CACHE_DISABLED:
+                try:
+                    _CACHE = AmapDiskCache(AMAP_CACHE_FILE)
+                except sqlite3.Error as e:
+                    logger.warning(f"⚠️ 高德缓存初始化失败，将不使用磁盘缓存: {e}")
+                    _CACHE_DISABLED = True
+    return _CACHE
@@ -1,16 +1,359 @@
 # api_tools.py
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
+import re
+import sqlite3
+import threading
 import time
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Dict, List, Optional, Tuple
 from config import AMAP_API_KEY, AMAP_GEOCODE_URL, AMAP_ROUTE_URL, SERPAPI_FLIGHTS_API_KEY, GOOGLE_FLIGHTS_URL, \
-    JUHE_TRAIN_API_KEY, JUHE_TRAIN_QUERY_URL
-from state import Location
+    JUHE_TRAIN_API_KEY, JUHE_TRAIN_QUERY_URL, AMAP_MAX_WORKERS, AMAP_RATE_PER_SEC, SERPAPI_RATE_PER_SEC, SERPAPI_BURST, \
+    JUHE_RATE_PER_SEC, AMAP_GEOCODE_BATCH_SIZE, AMAP_GEOCODE_MEMORY_CACHE_SIZE, GEOCODE_CACHE_TTL_SECONDS, \
+    DRIVING_TIME_CACHE_TTL_SECONDS
+from amap_cache import get_amap_cache
+from state import Location, TransportOption
+import numpy as np
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 MAX_RETRIES = 3 # 最大重试次数
 INITIAL_WAIT_TIME = 1.0 # 初始等待时间（秒）
 
+
+class RateLimiter:
+    """线程安全的令牌桶限流器：桶中有令牌时立即放行，只有超出速率时才阻塞等待。"""
+
+    def __init__(self, rate_per_sec: float, burst: int = 1):
+        self.rate_per_sec = rate_per_sec
+        self.capacity = float(burst)
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """获取一个令牌，令牌不足时休眠到补足为止。"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate_per_sec)
+            self._last_refill = now
+
+            if self._tokens < 1:
+                # 在锁内等待，保证并发线程按顺序依次放行
+                time.sleep((1 - self._tokens) / self.rate_per_sec)
+                self._last_refill = time.monotonic()
+                self._tokens = 0.0
+            else:
+                self._tokens -= 1
+
+
+_AMAP_LIMITER = RateLimiter(AMAP_RATE_PER_SEC, burst=int(AMAP_RATE_PER_SEC))
+_SERPAPI_LIMITER = RateLimiter(SERPAPI_RATE_PER_SEC, burst=SERPAPI_BURST)
+_JUHE_LIMITER = RateLimiter(JUHE_RATE_PER_SEC, burst=int(JUHE_RATE_PER_SEC))
+
+# 高德 QPS / 配额超限错误信息的关键词（如 CUQPS_HAS_EXCEEDED_THE_LIMIT、DAILY_QUERY_OVER_LIMIT）
+_LIMIT_RE = re.compile(r"LIMIT|QUOTA", re.IGNORECASE)
+
+
+def _is_amap_limit_response(response: requests.Response) -> bool:
+    """判断高德响应是否为 QPS / 配额超限（HTTP 200，但 status 为 0 且 info 含 LIMIT/QUOTA 等关键词）。"""
+    try:
+        data = orjson.loads(response.content)
+    except ValueError:
+        return False
+    if not isinstance(data, dict) or data.get("status") != "0":
+        return False
+    return _LIMIT_RE.search(str(data.get("info", ""))) is not None
+
+
+class _AmapRetryAdapter(HTTPAdapter):
+    """
+    高德专用适配器。
+    HTTP 层错误（429/5xx、连接失败）交给 urllib3.Retry 做指数退避；
+    高德在 HTTP 200 中返回的 QPS 超限错误 urllib3 无法识别，在此按相同的退避节奏重发。
+    """
+
+    def send(self, request, **kwargs):
+        _AMAP_LIMITER.acquire()
+        response = super().send(request, **kwargs)
+        wait_time = INITIAL_WAIT_TIME
+        for attempt in range(MAX_RETRIES - 1):
+            if not _is_amap_limit_response(response):
+                break
+            print(f"🚦 QPS 超限，尝试第 {attempt + 1} 次重试，等待 {wait_time:.1f} 秒...")
+            time.sleep(wait_time)
+            wait_time *= 2  # 指数退避：1.0s, 2.0s, 4.0s...
+            _AMAP_LIMITER.acquire()
+            response = super().send(request, **kwargs)
+        return response
+
+
+_AMAP_RETRY = Retry(
+    total=MAX_RETRIES,
+    backoff_factor=INITIAL_WAIT_TIME,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+# 全局复用的 HTTP 会话：高德 / SerpApi / 聚合数据 反复访问同一批主机，
+# 保持 keep-alive 连接可省去每次请求的 TCP + TLS 握手
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=0))
+# 高德连接池大小与并发线程数一致，pool_block=True 使并发线程等待复用空闲连接，
+# 而不是在池满时新建用完即丢的连接（每条都要重新 TCP + TLS 握手）
+_SESSION.mount("https://restapi.amap.com", _AmapRetryAdapter(pool_connections=1, pool_maxsize=AMAP_MAX_WORKERS,
+                                                             pool_block=True, max_retries=_AMAP_RETRY))
+_SESSION.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+# --- 地理编码缓存 ---
+# 内存层：键为 "城市|地址"，值为 ({lat, lon}, 写入时间戳)，最多 AMAP_GEOCODE_MEMORY_CACHE_SIZE 条，按 LRU 淘汰，
+# 命中时同样校验 GEOCODE_CACHE_TTL_SECONDS；磁盘层 (SQLite，见 amap_cache.py) 跨会话复用
+_GEOCODE_CACHE: "OrderedDict[str, Tuple[Dict[str, float], float]]" = OrderedDict()
+_GEOCODE_CACHE_LOCK = threading.Lock()
+# 正在请求中的 "城市|地址" -> 请求完成事件（同样由 _GEOCODE_CACHE_LOCK 保护）
+_GEOCODE_INFLIGHT: Dict[str, threading.Event] = {}
+
+
 def amap_geocode(address: str, city: str) -> Optional[Dict[str, float]]:
+    """
+    返回地址的经纬度。优先命中本地缓存，未命中时调用高德地理编码API，
+    成功结果写回缓存（失败结果不缓存，以便下次重试）。
+    """
+    address, city = address.strip(), city.strip()
+    cached = _get_cached_geocode(address, city)
+    if cached:
+        return cached
+
+    coords = _amap_geocode_request(address, city)
+    if coords:
+        _put_cached_geocode(coords, (address, city))
+    return coords
+
+
+def _get_cached_geocode(address: str, city: str) -> Optional[Dict[str, float]]:
+    """先查内存，再查磁盘；磁盘命中的结果回填内存。"""
+    cache_key = f"{city}|{address}"
+    with _GEOCODE_CACHE_LOCK:
+        entry = _GEOCODE_CACHE.get(cache_key)
+        if entry is not None:
+            if time.time() - entry[1] < GEOCODE_CACHE_TTL_SECONDS:
+                _GEOCODE_CACHE.move_to_end(cache_key)
+                return dict(entry[0])
+            del _GEOCODE_CACHE[cache_key]
+
+    disk_cache = get_amap_cache()
+    if disk_cache is None:
+        return None
+    try:
+        entry = disk_cache.get_geocode(address, city)
+    except sqlite3.Error as e:
+        print(f"⚠️ 读取地理编码缓存失败: {e}")
+        return None
+    if entry is None:
+        return None
+    # 沿用磁盘条目的写入时间，内存层不会把条目的有效期延长到 TTL 之外
+    with _GEOCODE_CACHE_LOCK:
+        _remember_geocode(cache_key, *entry)
+    return dict(entry[0])
+
+
+def _remember_geocode(cache_key: str, coords: Dict[str, float], ts: float) -> None:
+    """写入内存层并淘汰最久未使用的条目；调用方需持有 _GEOCODE_CACHE_LOCK。"""
+    _GEOCODE_CACHE[cache_key] = ({"lat": coords['lat'], "lon": coords['lon']}, ts)
+    _GEOCODE_CACHE.move_to_end(cache_key)
+    while len(_GEOCODE_CACHE) > AMAP_GEOCODE_MEMORY_CACHE_SIZE:
+        _GEOCODE_CACHE.popitem(last=False)
+
+
+def _put_cached_geocode(coords: Dict[str, float], *keys: Tuple[str, str]) -> None:
+    """将同一坐标写入一个或多个 (address, city) 键。"""
+    _put_cached_geocodes([(key, coords) for key in keys])
+
+
+def _put_cached_geocodes(entries: List[Tuple[Tuple[str, str], Dict[str, float]]]) -> None:
+    """批量写入 ((address, city), 坐标)：内存层逐条更新，磁盘层一次事务提交。"""
+    if not entries:
+        return
+    now = time.time()
+    with _GEOCODE_CACHE_LOCK:
+        for (address, city), coords in entries:
+            _remember_geocode(f"{city}|{address}", coords, now)
+
+    disk_cache = get_amap_cache()
+    if disk_cache is None:
+        return
+    try:
+        disk_cache.put_geocodes(entries)
+    except sqlite3.Error as e:
+        print(f"⚠️ 地理编码缓存写入失败: {e}")
+
+
+def prefetch_hub_geocodes(pairs: List[Tuple[str, str]]) -> threading.Thread:
+    """
+    在后台守护线程中预先地理编码交通枢纽，只为填充缓存，不返回结果。
+    后续节点调用 amap_geocode_batch 时可直接命中缓存；预取尚未完成的地址会等待预取结果，不会重复请求。
+    """
+    pending = [(address, city) for address, city in dict.fromkeys(pairs)
+               if address and not _get_cached_geocode(address.strip(), city.strip())]
+    thread = threading.Thread(target=amap_geocode_batch, args=(pending,), kwargs={"hub_fallback": True},
+                              name="hub-geocode-prefetch", daemon=True)
+    if pending:
+        thread.start()
+    return thread
+
+
+def amap_geocode_batch(pairs: List[Tuple[str, str]], hub_fallback: bool = False) -> List[Optional[Dict[str, float]]]:
+    """
+    并发地理编码多个 (address, city)，结果顺序与输入 pairs 一致。
+
+    未命中缓存的地址按城市分组，使用高德批量接口 (每次最多 AMAP_GEOCODE_BATCH_SIZE 个) 查询，
+    不同分组之间并发；批量请求失败时退回逐个查询。
+
+    Args:
+        pairs: (address, city) 列表。
+        hub_fallback: 为 True 时按交通枢纽处理：未命中缓存的枢纽同时查询原名和加“站”后缀两种写法
+            (同城会合并进同一个批量请求)，原名优先；仅后缀成功时坐标同时写入原名缓存键，
+            下次用原名查询可直接命中。
+
+    Returns:
+        与 pairs 一一对应的经纬度字典，失败项为 None。
+    """
+    if not pairs:
+        return []
+
+    pairs = [(address.strip(), city.strip()) for address, city in pairs]
+    if not hub_fallback:
+        return _geocode_many(pairs)
+
+    candidates = list(pairs)
+    station_idx: Dict[int, int] = {}  # pairs 下标 -> candidates 中“站”后缀写法的下标
+    for i, (address, city) in enumerate(pairs):
+        if not address.endswith('站') and not _get_cached_geocode(address, city):
+            station_idx[i] = len(candidates)
+            candidates.append((f"{address}站", city))
+
+    found = _geocode_many(candidates)
+    results = found[:len(pairs)]
+    aliases = []
+    for i, j in station_idx.items():
+        if not results[i] and found[j]:
+            results[i] = found[j]
+            aliases.append((pairs[i], found[j]))
+    _put_cached_geocodes(aliases)
+    return results
+
+
+def _geocode_many(pairs: List[Tuple[str, str]]) -> List[Optional[Dict[str, float]]]:
+    """
+    先查缓存，未命中的按城市分组批量请求（组间并发），成功结果统一写回缓存。
+    其他线程（如枢纽预取）正在请求的地址不重复请求，等其完成后直接读缓存。
+    """
+    results = [_get_cached_geocode(address, city) for address, city in pairs]
+
+    misses_by_city: Dict[str, List[int]] = {}
+    owned_keys: List[str] = []
+    waiting: Dict[int, threading.Event] = {}
+    with _GEOCODE_CACHE_LOCK:
+        for i, (address, city) in enumerate(pairs):
+            if results[i]:
+                continue
+            cache_key = f"{city}|{address}"
+            event = _GEOCODE_INFLIGHT.get(cache_key)
+            if event is None:
+                _GEOCODE_INFLIGHT[cache_key] = threading.Event()
+                owned_keys.append(cache_key)
+                misses_by_city.setdefault(city, []).append(i)
+            else:
+                waiting[i] = event
+    chunks = [indices[j:j + AMAP_GEOCODE_BATCH_SIZE]
+              for indices in misses_by_city.values()
+              for j in range(0, len(indices), AMAP_GEOCODE_BATCH_SIZE)]
+
+    def resolve(chunk: List[int]) -> List[Optional[Dict[str, float]]]:
+        city = pairs[chunk[0]][1]
+        addresses = [pairs[i][0] for i in chunk]
+        coords_list = None
+        # 批量接口用 "|" 分隔地址，地址本身含 "|" 时只能逐个查询
+        if len(addresses) > 1 and not any('|' in address for address in addresses):
+            coords_list = _amap_geocode_request_batch(addresses, city)
+        if coords_list is None:
+            coords_list = [_amap_geocode_request(address, city) for address in addresses]
+        return coords_list
+
+    try:
+        if chunks:
+            workers = min(AMAP_MAX_WORKERS, len(chunks))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                new_entries = []
+                for chunk, coords_list in zip(chunks, executor.map(resolve, chunks)):
+                    for i, coords in zip(chunk, coords_list):
+                        results[i] = coords
+                        if coords:
+                            new_entries.append((pairs[i], coords))
+            _put_cached_geocodes(new_entries)
+    finally:
+        # 结果已写回缓存后再唤醒等待者；失败的地址不缓存，等待者得到 None
+        with _GEOCODE_CACHE_LOCK:
+            for cache_key in owned_keys:
+                _GEOCODE_INFLIGHT.pop(cache_key).set()
+
+    for i, event in waiting.items():
+        event.wait()
+        results[i] = _get_cached_geocode(*pairs[i])
+    return results
+
+
+def _amap_geocode_request_batch(addresses: List[str], city: str) -> Optional[List[Optional[Dict[str, float]]]]:
+    """
+    调用高德批量地理编码 (batch=true)，结果与 addresses 一一对应，单个地址失败时为 None。
+    整个请求失败或返回条数不符时返回 None，由调用方退回逐个查询。
+    """
+    if not AMAP_API_KEY:
+        return None
+
+    params = {
+        "key": AMAP_API_KEY,
+        "address": "|".join(addresses),
+        "city": city,
+        "batch": "true",
+        "output": "json"
+    }
+
+    try:
+        response = _SESSION.get(AMAP_GEOCODE_URL, params=params, timeout=5)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+
+        geocodes = data.get("geocodes") or []
+        if data.get("status") != "1" or len(geocodes) != len(addresses):
+            print(f"⚠️ 高德批量地理编码失败，改为逐个查询。状态码: {data.get('status')}, 原因: {data.get('info')}")
+            return None
+
+        results = []
+        for geocode in geocodes:
+            location_str = geocode.get("location")  # 单个地址无结果时为空字符串或空列表
+            if isinstance(location_str, str) and location_str:
+                lon, lat = map(float, location_str.split(','))
+                results.append({"lat": lat, "lon": lon})
+            else:
+                results.append(None)
+        return results
+
+    except requests.exceptions.RequestException as e:
+        print(f"❌ 高德批量地理编码请求失败，改为逐个查询: {e}")
+        return None
+    except Exception as e:
+        print(f"❌ 处理高德批量地理编码响应时发生错误，改为逐个查询: {e}")
+        return None
+
+
+def _amap_geocode_request(address: str, city: str) -> Optional[Dict[str, float]]:
     """调用高德地理编码API，返回经纬度"""
     if not AMAP_API_KEY:
         print("❌ 致命错误：AMAP_API_KEY 未配置，无法进行地理编码。")
@@ -24,9 +367,9 @@ def amap_geocode(address: str, city: str) -> Optional[Dict[str, float]]:
     }
 
     try:
-        response = requests.get(AMAP_GEOCODE_URL, params=params, timeout=5)
+        response = _SESSION.get(AMAP_GEOCODE_URL, params=params, timeout=5)
         response.raise_for_status()  # 检查 HTTP 错误
-        data = response.json()
+        data = orjson.loads(response.content)
 
         # 高德 API 成功响应检查
         if data.get("status") == "1" and int(data.get("count", 0)) > 0:
@@ -49,10 +392,24 @@ def amap_geocode(address: str, city: str) -> Optional[Dict[str, float]]:
         return None
 
 
+@lru_cache(maxsize=1024)
+def _prepare_amap_route_request(origin_coords: str, destination_coords: str) -> requests.PreparedRequest:
+    """构造并缓存高德路径规划请求：同一起终点对在进程内只做一次参数拼装和 URL 编码。"""
+    params = {
+        "key": AMAP_API_KEY,
+        "origin": origin_coords,
+        "destination": destination_coords,
+        "output": "json",
+        "extensions": "base",
+        "strategy": 0
+    }
+    return _SESSION.prepare_request(requests.Request("GET", AMAP_ROUTE_URL, params=params))
+
+
 def get_amap_driving_time(origin: Location, destination: Location) -> Optional[float]:
     """
     实际调用高德路径规划API，计算两个地点间的驾车耗时（分钟）。
-    加入延时和指数退避重试机制，以解决 QPS 超限问题。
+    QPS 超限的指数退避重试由会话适配器 (_AmapRetryAdapter + urllib3.Retry) 完成。
 
     Args:
         origin: 起点 Location 结构 (需要 lat/lon)。
@@ -70,95 +427,228 @@ def get_amap_driving_time(origin: Location, destination: Location) -> Optional[f
         print(f"⚠️ 无法计算驾车时间: 起点或终点的经纬度缺失。")
         return 35.0  # 使用经验值回退
 
-    # 2. 构造请求参数
-    origin_coords = f"{origin['lon']},{origin['lat']}"
-    destination_coords = f"{destination['lon']},{destination['lat']}"
+    # 2. 坐标取 5 位小数 (约 1 米) 作为缓存键，同一起终点对在进程内只查询一次
+    try:
+        return _driving_time_cached(*_route_key(origin, destination))
+    except _RouteUnavailable:
+        return None
+
+
+def _route_key(origin: Location, destination: Location) -> Tuple[float, float, float, float]:
+    return (round(origin['lat'], 5), round(origin['lon'], 5),
+            round(destination['lat'], 5), round(destination['lon'], 5))
 
-    params = {
-        "key": AMAP_API_KEY,
-        "origin": origin_coords,
-        "destination": destination_coords,
-        "output": "json",
-        "extensions": "base",
-        "strategy": 0
-    }
 
-    wait_time = INITIAL_WAIT_TIME
+# --- 驾车时间缓存 ---
+# 内存层：键为四舍五入后的起终点坐标，值为 (分钟, 写入时间戳)，按 LRU 淘汰；
+# 与磁盘层使用同一个 DRIVING_TIME_CACHE_TTL_SECONDS，长驻进程 (app.py) 中过期条目会重新查询
+_ROUTE_CACHE_MAXSIZE = 8192
+_ROUTE_CACHE: "OrderedDict[Tuple[float, float, float, float], Tuple[float, float]]" = OrderedDict()
+_ROUTE_CACHE_LOCK = threading.Lock()
 
-    # === 循环重试机制开始 ===
-    for attempt in range(MAX_RETRIES):
+
+class _RouteUnavailable(Exception):
+    """路径查询失败；失败结果不缓存，下次调用会重新查询。"""
+
+
+def _driving_time_cached(origin_lat: float, origin_lon: float, dest_lat: float, dest_lon: float) -> float:
+    """内存层未命中或已过期时先查磁盘缓存，再请求高德；成功结果写回两层缓存。"""
+    key = (origin_lat, origin_lon, dest_lat, dest_lon)
+    now = time.time()
+    with _ROUTE_CACHE_LOCK:
+        entry = _ROUTE_CACHE.get(key)
+        if entry is not None:
+            if now - entry[1] < DRIVING_TIME_CACHE_TTL_SECONDS:
+                _ROUTE_CACHE.move_to_end(key)
+                return entry[0]
+            del _ROUTE_CACHE[key]
+
+    entry = None
+    disk_cache = get_amap_cache()
+    if disk_cache is not None:
         try:
-            # 1. 发送请求
-            response = requests.get(AMAP_ROUTE_URL, params=params, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-
-            # 2. 检查高德 API 状态码
-            if data.get("status") == "1" and int(data.get("count", 0)) > 0:
-                # 路径规划成功，返回结果
-                route = data['route']['paths'][0]
-                duration_seconds = int(route.get('duration', 0))
-                return round(duration_seconds / 60.0, 1)
-
-            # 3. API 错误处理，特别是针对 QPS 超限
-            error_reason = data.get('info', '未知错误')
-
-            # 检查是否为 QPS 或配额相关错误 (状态码通常为 0，错误信息包含 LIMIT/QUOTA等关键词)
-            is_limit_error = (data.get("status") == "0" and
-                              ('LIMIT' in error_reason.upper() or
-                               'QUOTA' in error_reason.upper()))
-
-            if is_limit_error:
-                if attempt < MAX_RETRIES - 1:
-                    # 进行重试
-                    print(f"🚦 QPS 超限，尝试第 {attempt + 1} 次重试，等待 {wait_time:.1f} 秒...")
-                    time.sleep(wait_time)
-                    wait_time *= 2  # 指数退避：1.0s, 2.0s, 4.0s...
-                    continue  # 跳转到下一个循环
-                else:
-                    # 达到最大重试次数
-                    print(f"❌ 高德路径规划失败: 已达最大重试次数，原因: {error_reason}")
-                    return None
-            else:
-                # 其他 API 错误（例如参数错误等），不重试
-                print(f"⚠️ 高德路径规划 API 返回失败。状态码: {data.get('status')}, 原因: {error_reason}")
-                return None
-
-        except requests.exceptions.RequestException as e:
-            # 网络或 HTTP 错误，通常表示瞬时网络问题
-            if attempt < MAX_RETRIES - 1:
-                print(f"❌ API 请求失败 (网络错误)，尝试第 {attempt + 1} 次重试，等待 {wait_time:.1f} 秒...")
-                time.sleep(wait_time)
-                wait_time *= 2
-                continue
-            else:
-                print(f"❌ 高德路径规划 API 请求失败: {e}")
-                return None
+            entry = disk_cache.get_route(key)
+        except sqlite3.Error as e:
+            print(f"⚠️ 读取驾车时间缓存失败: {e}")
+
+    if entry is None:
+        minutes = _request_driving_time(f"{origin_lon},{origin_lat}", f"{dest_lon},{dest_lat}")
+        if minutes is None:
+            raise _RouteUnavailable
+        entry = (minutes, time.time())
+        if disk_cache is not None:
+            try:
+                disk_cache.put_route(key, minutes)
+            except sqlite3.Error as e:
+                print(f"⚠️ 驾车时间缓存写入失败: {e}")
 
-        except Exception as e:
-            # 捕获其他未知错误 (如 JSON 解析错误)
-            print(f"❌ 处理高德路径规划 API 响应时发生错误: {e}")
-            return None
+    # 磁盘命中时沿用磁盘条目的写入时间，内存层不会把条目的有效期延长到 TTL 之外
+    with _ROUTE_CACHE_LOCK:
+        _ROUTE_CACHE[key] = entry
+        _ROUTE_CACHE.move_to_end(key)
+        if len(_ROUTE_CACHE) > _ROUTE_CACHE_MAXSIZE:
+            _ROUTE_CACHE.popitem(last=False)
+    return entry[0]
 
-    return None  # 如果循环自然结束（不应该发生），返回 None
 
+def _request_driving_time(origin_coords: str, destination_coords: str) -> Optional[float]:
+    """发送一次高德路径规划请求，返回驾车耗时（分钟），失败返回 None。"""
+    # 获取（或复用）该起终点对的预编码请求
+    prepared = _prepare_amap_route_request(origin_coords, destination_coords)
+
+    try:
+        # 重试（HTTP 错误与 QPS 超限）由会话上挂载的 _AmapRetryAdapter 统一处理，重试时复用同一个 PreparedRequest
+        settings = _SESSION.merge_environment_settings(prepared.url, {}, None, None, None)
+        response = _SESSION.send(prepared, timeout=5, **settings)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
 
-CITY_TO_PRIMARY_IATA = {
+        # 检查高德 API 状态码
+        if data.get("status") == "1" and int(data.get("count", 0)) > 0:
+            # 路径规划成功，返回结果
+            route = data['route']['paths'][0]
+            duration_seconds = int(route.get('duration', 0))
+            return round(duration_seconds / 60.0, 1)
+
+        # 参数错误，或重试后仍然 QPS 超限
+        error_reason = data.get('info', '未知错误')
+        print(f"⚠️ 高德路径规划 API 返回失败。状态码: {data.get('status')}, 原因: {error_reason}")
+        return None
+
+    except requests.exceptions.RequestException as e:
+        # 网络或 HTTP 错误（已耗尽重试次数）
+        print(f"❌ 高德路径规划 API 请求失败: {e}")
+        return None
+
+    except Exception as e:
+        # 捕获其他未知错误 (如 JSON 解析错误)
+        print(f"❌ 处理高德路径规划 API 响应时发生错误: {e}")
+        return None
+
+
+def get_amap_driving_time_batch(pairs: List[Tuple[Location, Location]]) -> List[Optional[float]]:
+    """
+    并发计算多组 (起点, 终点) 的驾车耗时，结果顺序与输入 pairs 一致。
+
+    Args:
+        pairs: (origin, destination) Location 对列表。
+
+    Returns:
+        与 pairs 一一对应的驾车耗时（分钟），失败项为 None。
+    """
+    if not pairs:
+        return []
+
+    # 同一批内的重复起终点对只查询一次（并发的重复请求会同时错过内存缓存）；
+    # 缺少坐标的对按下标区分，交给 get_amap_driving_time 走经验值回退
+    keys = [_route_key(o, d) if o.get('lat') and d.get('lat') else i for i, (o, d) in enumerate(pairs)]
+    unique_pairs: Dict = {}
+    for key, pair in zip(keys, pairs):
+        unique_pairs.setdefault(key, pair)
+
+    workers = min(AMAP_MAX_WORKERS, len(unique_pairs))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        times = dict(zip(unique_pairs, executor.map(lambda pair: get_amap_driving_time(*pair), unique_pairs.values())))
+    return [times[key] for key in keys]
+
+
+def build_time_matrix(locations: List[Location]) -> np.ndarray:
+    """
+    一次性并发查询一组地点两两之间的驾车耗时，返回 (K, K) 矩阵，matrix[i, j] 为 i -> j 的分钟数。
+    对角线为 0，无法规划的路线为 NaN。
+    """
+    k = len(locations)
+    matrix = np.zeros((k, k), dtype=np.float64)
+    index_pairs = [(i, j) for i in range(k) for j in range(k) if i != j]
+    times = get_amap_driving_time_batch([(locations[i], locations[j]) for i, j in index_pairs])
+    for (i, j), t in zip(index_pairs, times):
+        matrix[i, j] = np.nan if t is None else t
+    return matrix
+
+
+CITY_TO_PRIMARY_IATA = MappingProxyType({
     "北京": "PEK",
     "上海": "PVG",
     "深圳": "SZX",
     "广州": "CAN",
     "杭州": "HGH",
     "成都": "CTU"
-}
+})
 
+# 反向映射：IATA 代码 -> 城市名，用于从航段的机场代码还原城市
+IATA_TO_CITY = MappingProxyType({iata: city for city, iata in CITY_TO_PRIMARY_IATA.items()})
 
+
+@lru_cache(maxsize=64)
 def get_iata_code(city_name: str) -> Optional[str]:
     """根据城市名获取其主要 IATA 代码。"""
     return CITY_TO_PRIMARY_IATA.get(city_name.strip(), None)
 
 
-def query_flight_api(origin: str, destination: str, date: str) -> List[Dict]:
+# SerpApi / 聚合数据 的时间格式通常为 'YYYY-MM-DD HH:MM'
+_API_TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def parse_ymdhm(time_str: str) -> datetime:
+    """解析 'YYYY-MM-DD HH:MM' 时间字符串：优先走 C 实现的 fromisoformat，非标准格式（如小时未补零）回退到 strptime。"""
+    try:
+        return datetime.fromisoformat(time_str)
+    except ValueError:
+        return datetime.strptime(time_str, _API_TIME_FORMAT)
+
+
+def _parse_flight_group(group: Dict) -> Optional[TransportOption]:
+    """将 SerpApi 的单个航班组转换为标准化的交通选项，数据不完整时返回 None。"""
+    group_price = group.get('price')
+    if not group_price:
+        return None
+
+    # 简化：只处理直飞或单段行程 (即 group['flights'] 列表只有一个元素)
+    flight_segment = (group.get('flights') or [{}])[0]
+    if not flight_segment:
+        return None
+
+    dep_air = flight_segment.get('departure_airport') or {}
+    arr_air = flight_segment.get('arrival_airport') or {}
+
+    # --- 提取和解析时间 ---
+    departure_dt_str = dep_air.get('time')
+    arrival_dt_str = arr_air.get('time')
+    if not departure_dt_str or not arrival_dt_str:
+        return None
+
+    try:
+        departure_dt = parse_ymdhm(departure_dt_str)
+        arrival_dt = parse_ymdhm(arrival_dt_str)
+    except ValueError:
+        return None
+
+    # --- 构造标准化结构 ---
+    return TransportOption(
+        # 保持 type 字段一致
+        type="Flight",
+        # 保持 id 字段一致 (航班号)
+        id=flight_segment.get('flight_number', 'N/A'),
+
+        # 保持时刻字段一致
+        departure_time=f"{departure_dt.hour:02d}:{departure_dt.minute:02d}",
+        arrival_time=f"{arrival_dt.hour:02d}:{arrival_dt.minute:02d}",
+
+        # 保持价格、时长字段一致
+        price=group_price,
+        duration=group.get('total_duration'),  # SerpApi返回的是分钟，与高铁 API 的格式可能不完全一致，但类型一致
+
+        # 保持枢纽字段一致 (航段的 IATA 代码对应火车站名称)
+        departure_hub=dep_air.get('id'),
+        arrival_hub=arr_air.get('id'),
+
+        # 保持日期字段一致
+        departure_date=departure_dt.date().isoformat(),
+        arrival_date=arrival_dt.date().isoformat()
+    )
+
+
+def query_flight_api(origin: str, destination: str, date: str) -> List[TransportOption]:
     """
     使用 SerpApi 的 google_flights 引擎查询航班，输入使用 IATA 代码。
     """
@@ -186,68 +676,16 @@ def query_flight_api(origin: str, destination: str, date: str) -> List[Dict]:
     }
 
     try:
-        # 增加延时以缓解 QPS 限制问题
-        time.sleep(1)
+        # 令牌桶限流以缓解 QPS 限制问题（仅在超出速率时等待）
+        _SERPAPI_LIMITER.acquire()
 
-        response = requests.get(GOOGLE_FLIGHTS_URL, params=params, timeout=20)
+        response = _SESSION.get(GOOGLE_FLIGHTS_URL, params=params, timeout=20)
         response.raise_for_status()
-        data = response.json()
-
-        all_flights = []
+        data = orjson.loads(response.content)
 
         # 收集所有航班列表：'best_flights' 和 'other_flights'
         flight_groups = data.get('best_flights', []) + data.get('other_flights', [])
-
-        for group in flight_groups:
-            # 简化：只处理直飞或单段行程 (即 group['flights'] 列表只有一个元素)
-            flight_segment = group.get('flights', [{}])[0]
-
-            if not flight_segment or not group.get('price'):
-                continue
-
-            # --- 提取和解析时间 ---
-            departure_dt_str = flight_segment.get('departure_airport', {}).get('time')
-            arrival_dt_str = flight_segment.get('arrival_airport', {}).get('time')
-
-            if not departure_dt_str or not arrival_dt_str:
-                continue
-
-            # SerpApi 格式通常为 'YYYY-MM-DD HH:MM'
-            time_format = '%Y-%m-%d %H:%M'
-
-            try:
-                departure_dt = datetime.strptime(departure_dt_str, time_format)
-                arrival_dt = datetime.strptime(arrival_dt_str, time_format)
-            except ValueError:
-                continue
-
-            # 航班的枢纽是 IATA 代码
-            departure_iata = flight_segment.get('departure_airport', {}).get('id')
-            arrival_iata = flight_segment.get('arrival_airport', {}).get('id')
-
-            # --- 构造标准化字典 ---
-            all_flights.append({
-                # 保持 type 字段一致
-                "type": "Flight",
-                # 保持 id 字段一致 (航班号)
-                "id": flight_segment.get('flight_number', 'N/A'),
-
-                # 保持时刻字段一致
-                "departure_time": departure_dt.strftime('%H:%M'),
-                "arrival_time": arrival_dt.strftime('%H:%M'),
-
-                # 保持价格、时长字段一致
-                "price": group['price'],
-                "duration": group['total_duration'],  # SerpApi返回的是分钟，与高铁 API 的格式可能不完全一致，但类型一致
-
-                # 保持枢纽字段一致 (IATA 代码对应火车站名称)
-                "departure_hub": departure_iata,
-                "arrival_hub": arrival_iata,
-
-                # 保持日期字段一致
-                "departure_date": departure_dt.strftime('%Y-%m-%d'),
-                "arrival_date": arrival_dt.strftime('%Y-%m-%d')
-            })
+        all_flights = [flight for flight in map(_parse_flight_group, flight_groups) if flight]
 
         print(f"✅ 航班查询成功。共找到 {len(all_flights)} 个航班选项。")
         return all_flights
@@ -260,9 +698,9 @@ def query_flight_api(origin: str, destination: str, date: str) -> List[Dict]:
         return []
 
 
-def query_train_api(origin: str, destination: str, date: str, filter: str = "G") -> List[Dict]:
+def query_train_api(origin: str, destination: str, date: str, filter: str = "G") -> List[TransportOption]:
     """
-    实际调用聚合数据 API 进行高铁查询，返回 List[Dict]。
+    实际调用聚合数据 API 进行高铁查询，返回 List[TransportOption]。
     """
     print(f"🚄 正在调用聚合 API 查询 {date} 从 {origin} 到 {destination} 的高铁")
 
@@ -270,8 +708,9 @@ def query_train_api(origin: str, destination: str, date: str, filter: str = "G")
         print("❌ 致命错误：JUHE_TRAIN_API_KEY 未配置，使用模拟数据。")
         # 回退逻辑保持简单
         return [
-            {"type": "Train", "id": "G101", "departure_time": "07:30", "arrival_time": "13:30", "price": 600,
-             "duration": "6h00m", "departure_hub": f"{origin} 火车站", "arrival_hub": f"{destination} 火车站"},
+            TransportOption(type="Train", id="G101", departure_time="07:30", arrival_time="13:30", price=600,
+                            duration="6h00m", departure_hub=f"{origin} 火车站", arrival_hub=f"{destination} 火车站",
+                            departure_date=date, arrival_date=date),
         ]
 
     params = {
@@ -286,16 +725,18 @@ def query_train_api(origin: str, destination: str, date: str, filter: str = "G")
 
     try:
         # ... (API 调用和响应处理逻辑保持不变) ...
-        response = requests.get(JUHE_TRAIN_QUERY_URL, params=params, timeout=10)
+        _JUHE_LIMITER.acquire()
+        response = _SESSION.get(JUHE_TRAIN_QUERY_URL, params=params, timeout=10)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
 
         if data.get("error_code") != 0:
             print(f"⚠️ 聚合数据高铁查询失败。日期: {date}, 原因: {data.get('reason')}")
             return []
 
-        # 转换 API 返回结果为我们内部需要的 List[Dict] 格式
+        # 转换 API 返回结果为我们内部需要的 List[TransportOption] 格式
         train_options = []
+        date_prefix = f"{date} "
         for item in data.get("result", []):
 
             second_class_price_item = next(
@@ -308,34 +749,34 @@ def query_train_api(origin: str, destination: str, date: str, filter: str = "G")
 
             # 1. 创建出发和到达的 datetime 对象 (初始都假设在出发日期)
             departure_date_str = date
-            start_dt = datetime.strptime(f"{departure_date_str} {departure_time_str}", '%Y-%m-%d %H:%M')
-            arrival_dt = datetime.strptime(f"{departure_date_str} {arrival_time_str}", '%Y-%m-%d %H:%M')
+            start_dt = parse_ymdhm(date_prefix + departure_time_str)
+            arrival_dt = parse_ymdhm(date_prefix + arrival_time_str)
 
             # 2. 跨天修正：如果到达时刻早于出发时刻，则到达日期加一天
             if arrival_dt < start_dt:
                 arrival_dt += timedelta(days=1)
 
             # 3. 提取最终的到达日期字符串
-            arrival_date_str = arrival_dt.strftime('%Y-%m-%d')
+            arrival_date_str = arrival_dt.date().isoformat()
 
-            # --- 💡 修正点：将日期信息添加到字典中 ---
-            train_options.append({
-                "type": "Train",
-                "id": item["train_no"],
+            # --- 💡 修正点：将日期信息添加到班次选项中 ---
+            train_options.append(TransportOption(
+                type="Train",
+                id=item["train_no"],
 
                 # 原始 API 返回的时刻
-                "departure_time": departure_time_str,
-                "arrival_time": arrival_time_str,
+                departure_time=departure_time_str,
+                arrival_time=arrival_time_str,
 
-                "price": second_class_price_item["price"],
-                "duration": item["duration"],
-                "departure_hub": item["departure_station"],
-                "arrival_hub": item["arrival_station"],
+                price=second_class_price_item["price"],
+                duration=item["duration"],
+                departure_hub=item["departure_station"],
+                arrival_hub=item["arrival_station"],
 
                 # ✅ 关键新增字段：让 LLM 知道班次对应的日期
-                "departure_date": departure_date_str,
-                "arrival_date": arrival_date_str
-            })
+                departure_date=departure_date_str,
+                arrival_date=arrival_date_str
+            ))
 
         return train_options
 
@@ -352,3 +793,26 @@ def query_train_api(origin: str, destination: str, date: str, filter: str = "G")
 
 
 
+
+
+
+def query_transport_options(origin: str, destination: str,
+                            *dates: str) -> Tuple[List[TransportOption], List[TransportOption]]:
+    """
+    并发查询若干日期的航班和高铁（所有请求互不依赖，总耗时取最慢的一次；各 API 的 QPS 由限流器保证）。
+
+    Returns:
+        (航班选项列表, 高铁选项列表)，均按传入日期的顺序拼接
+
+    Raises:
+        ValueError: 未传入任何查询日期。
+    """
+    if not dates:
+        raise ValueError("query_transport_options 至少需要一个查询日期 (YYYY-MM-DD)。")
+
+    with ThreadPoolExecutor(max_workers=2 * len(dates)) as executor:
+        flight_futures = [executor.submit(query_flight_api, origin, destination, d) for d in dates]
+        train_futures = [executor.submit(query_train_api, origin, destination, d) for d in dates]
+        flights = [opt for f in flight_futures for opt in f.result()]
+        trains = [opt for f in train_futures for opt in f.result()]
+    return flights, trains
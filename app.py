@@ -9,7 +9,8 @@ from langchain_openai import ChatOpenAI
 from config import DEEPSEEK_API_KEY
 # --- 导入您的 LangGraph 模块 ---
 # 确保 graph.py, state.py, nodes.py 在同一目录
-from graph import build_travel_graph
+from graph import COMPILED_GRAPH
+from main import setup_logging
 from state import TravelPlanState  # 导入您的状态类
 
 # --- 1. Streamlit 界面配置 ---
@@ -39,6 +40,9 @@ def initialize_agent():
     """
     st.info("💡 正在初始化 LangGraph 模型和 LLM 客户端...")
 
+    # 2.0 日志：与 main.py 共用 setup_logging，节点与 LLM 模块的 logger 输出到控制台（进程内只配置一次）
+    setup_logging()
+
     # 2.1 ✅ 密钥安全读取
     try:
         api_key = DEEPSEEK_API_KEY
@@ -49,10 +53,8 @@ def initialize_agent():
     # 2.2 初始化 LLM 客户端 (供 LangGraph 节点使用)
     llm_client = ChatOpenAI(api_key=api_key, model="deepseek-chat", temperature=0)  # 建议规划类任务使用低温度
 
-    # 2.3 构建并编译 LangGraph
-    workflow = build_travel_graph()
-    # 编译图
-    compiled_graph = workflow.compile()
+    # 2.3 LangGraph 已在 graph 模块导入时编译完成，直接复用
+    compiled_graph = COMPILED_GRAPH
 
     st.success("✅ 初始化完成！您可以开始提问了。")
     return llm_client, compiled_graph
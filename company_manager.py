@@ -1,6 +1,10 @@
 # company_manager.py
-import json
-from typing import List, Dict, Any
+import atexit
+import os
+from dataclasses import dataclass
+import numpy as np
+import orjson
+from typing import List, Dict, Any, Tuple
 from api_tools import amap_geocode
 
 # 数据文件路径
@@ -10,20 +14,116 @@ DATA_FILE = 'companies_data.json'
 def _load_data() -> Dict[str, List[Dict[str, Any]]]:
     """从 JSON 文件加载所有企业数据。"""
     try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(DATA_FILE, 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         # 如果文件不存在，返回一个空字典，以便后续创建
         return {}
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         print(f"❌ 警告: {DATA_FILE} 文件内容格式错误，将使用空数据。")
         return {}
 
 
 def _save_data(data: Dict[str, List[Dict[str, Any]]]) -> None:
-    """将所有企业数据保存到 JSON 文件。"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    """
+    将所有企业数据保存到 JSON 文件（先写临时文件再原子替换，避免写到一半损坏数据）。
+    逐个企业序列化并写入，避免一次性在内存中生成整个文件的 JSON 字符串；每个企业占一行，便于阅读和 diff。
+    """
+    tmp_file = f"{DATA_FILE}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(b'{')
+        for city_index, (city, companies) in enumerate(data.items()):
+            # orjson 直接输出 UTF-8（等价于 ensure_ascii=False）
+            f.write(b',\n  ' if city_index else b'\n  ')
+            f.write(orjson.dumps(str(city)) + b': [')
+            for company_index, company in enumerate(companies):
+                f.write(b',\n    ' if company_index else b'\n    ')
+                f.write(orjson.dumps(company))
+            f.write(b'\n  ]' if companies else b']')
+        f.write(b'\n}\n' if data else b'}\n')
+    os.replace(tmp_file, DATA_FILE)
+
+
+# --- 内存数据库 ---
+# COMPANIES_DB 是唯一的数据源：CRUD 直接修改内存并标记 _dirty，每次修改后由 flush_data() 落盘
+COMPANIES_DB: Dict[str, List[Dict[str, Any]]] = _load_data()
+_dirty = False
+
+# 二级索引 (城市, 企业ID) -> 企业字典，与 COMPANIES_DB 中的对象为同一引用
+_INDEX: Dict[Tuple[str, str], Dict[str, Any]] = {
+    (city, company.get('id')): company
+    for city, companies in COMPANIES_DB.items()
+    for company in companies
+}
+
+
+
+
+@dataclass(frozen=True)
+class CityArrays:
+    """
+    某城市企业的列式视图：companies[i] 与 lats[i]/lons[i]/names[i]/addresses[i] 一一对应，
+    用于向量化的距离预筛选。缺少 name/address/lat/lon 的记录不纳入。
+    """
+    companies: List[Dict[str, Any]]
+    names: List[str]
+    addresses: List[str]
+    lats: np.ndarray
+    lons: np.ndarray
+
+
+# 城市 -> CityArrays 的懒加载缓存，任何 CRUD 修改后整体失效
+_CITY_ARRAYS: Dict[str, CityArrays] = {}
+
+
+def get_city_arrays(city: str) -> CityArrays:
+    """获取（必要时构建）指定城市企业的列式数组。"""
+    arrays = _CITY_ARRAYS.get(city)
+    if arrays is None:
+        companies = []
+        for company in COMPANIES_DB.get(city, []):
+            missing = [key for key in ('name', 'address', 'lat', 'lon') if key not in company]
+            if missing:
+                print(f"⚠️ 企业 {company.get('name')} 原始数据缺失键: {missing}，筛选时跳过。")
+                continue
+            companies.append(company)
+        coords = np.array(
+            [(c['lat'], c['lon']) for c in companies], dtype=np.float64
+        ).reshape(-1, 2)  # None 坐标转为 NaN
+        arrays = CityArrays(
+            companies=companies,
+            names=[c['name'] for c in companies],
+            addresses=[c['address'] for c in companies],
+            lats=np.ascontiguousarray(coords[:, 0]),
+            lons=np.ascontiguousarray(coords[:, 1]),
+        )
+        _CITY_ARRAYS[city] = arrays
+    return arrays
+
+
+def _mark_dirty() -> None:
+    global _dirty
+    _dirty = True
+    _CITY_ARRAYS.clear()
+
+
+def _index_company(city: str, company_id: str, company: Dict[str, Any]) -> None:
+    """登记 (城市, 企业ID) 索引；ID 已被其他企业占用时抛出 ValueError，避免静默覆盖。"""
+    existing = _INDEX.get((city, company_id))
+    if existing is not None and existing is not company:
+        raise ValueError(f"企业 ID 冲突: {city} 中已存在 {company_id}")
+    _INDEX[(city, company_id)] = company
+
+
+def flush_data() -> None:
+    """如有未保存的修改，将内存数据写回 JSON 文件。每次 CRUD 修改后调用，进程退出时再兜底调用一次。"""
+    global _dirty
+    if _dirty:
+        _save_data(COMPANIES_DB)
+        _dirty = False
+
+
+atexit.register(flush_data)
 
 
 # --- CRUD 操作函数 ---
@@ -34,18 +134,20 @@ def add_company(city: str, name: str, address: str) -> None:
     向指定城市添加一个新企业。
     ID格式为：[城市名][三位序号]，并根据地址自动获取经纬度。
     """
-    data = _load_data()
-
     # 城市名作为字典的键，保持与数据文件格式一致（例如："深圳"）
-    if city not in data:
-        data[city] = []
+    city_companies = COMPANIES_DB.setdefault(city, [])
 
     prefix = city
-    new_index = len(data[city]) + 1
+    new_index = len(city_companies) + 1
     new_id = f"{prefix}{new_index:03}"
-
-    # 2. 自动获取经纬度
-    coords = amap_geocode(address, city)
+    # 删除企业后序号可能已被占用，顺延到第一个未使用的序号
+    while (city, new_id) in _INDEX:
+        new_index += 1
+        new_id = f"{prefix}{new_index:03}"
+
+    # 2. 自动获取经纬度：同城已有相同地址的企业时直接复用其坐标，避免重复调用 API
+    known = next((c for c in city_companies if c.get('address') == address and c.get('lat') and c.get('lon')), None)
+    coords = {'lat': known['lat'], 'lon': known['lon']} if known else amap_geocode(address, city)
     lat = coords['lat'] if coords else 0.0
     lon = coords['lon'] if coords else 0.0
 
@@ -60,8 +162,10 @@ def add_company(city: str, name: str, address: str) -> None:
         'description': '用户新增'
     }
 
-    data[city].append(company_info)
-    _save_data(data)
+    _index_company(city, new_id, company_info)
+    city_companies.append(company_info)
+    _mark_dirty()
+    flush_data()
     print(f"✅ 成功添加企业: {name} (ID: {new_id}) 到 {city}。")
     print(f"   -> 经纬度自动获取: Lat={lat}, Lon={lon}")
 
@@ -70,43 +174,37 @@ def add_company(city: str, name: str, address: str) -> None:
 # R: Read/Get (会被 planning_tools 调用)
 def get_companies_by_city(city: str) -> List[Dict[str, Any]]:
     """获取指定城市的所有企业列表。"""
-    data = _load_data()
-    return data.get(city, [])
+    return COMPANIES_DB.get(city, [])
 
 
 # U: Update
 def update_company(city: str, company_id: str, updates: Dict[str, Any]) -> bool:
     """更新指定城市和ID的企业信息。"""
-    data = _load_data()
-    if city not in data:
+    company = _INDEX.get((city, company_id))
+    if company is None:
         return False
 
-    for i, company in enumerate(data[city]):
-        if company.get('id') == company_id:
-            data[city][i].update(updates)
-            _save_data(data)
-            print(f"✅ 成功更新企业: {company['name']} ({company_id})")
-            return True
-
-    return False
+    # 如果 ID 被修改，先登记新索引（冲突时抛错且不修改企业数据），再移除旧索引
+    new_id = updates.get('id', company_id)
+    if new_id != company_id:
+        _index_company(city, new_id, company)
+        del _INDEX[(city, company_id)]
+    company.update(updates)
+    _mark_dirty()
+    flush_data()
+    print(f"✅ 成功更新企业: {company['name']} ({company_id})")
+    return True
 
 
 # D: Delete
 def delete_company(city: str, company_id: str) -> bool:
     """删除指定城市和ID的企业。"""
-    data = _load_data()
-    if city not in data:
+    company = _INDEX.pop((city, company_id), None)
+    if company is None:
         return False
 
-    initial_count = len(data[city])
-    data[city] = [c for c in data[city] if c.get('id') != company_id]
-
-    if len(data[city]) < initial_count:
-        _save_data(data)
-        print(f"✅ 成功删除企业 ID: {company_id} 从 {city}")
-        return True
-
-    return False
-
-
-COMPANIES_DB = _load_data()
\ No newline at end of file
+    COMPANIES_DB[city] = [c for c in COMPANIES_DB[city] if c is not company]
+    _mark_dirty()
+    flush_data()
+    print(f"✅ 成功删除企业 ID: {company_id} 从 {city}")
+    return True
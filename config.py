@@ -11,6 +11,16 @@ SERPAPI_FLIGHTS_API_KEY = os.getenv("SERPAPI_FLIGHTS_API_KEY")
 
 LLM_MODEL = "deepseek-chat"
 TEMPERATURE = 0.5
+# 输入参数抽取先用廉价模型尝试，结构不合法或字段缺失时再升级到 LLM_MODEL；
+# 未配置或与 LLM_MODEL 相同时不走级联，直接使用 LLM_MODEL
+CHEAP_LLM_MODEL = os.getenv("CHEAP_LLM_MODEL", "")
+SCORING_BATCH_SIZE = 10  # 企业评分时每次 LLM 调用包含的企业数，多批次并发请求
+LLM_CACHE_FILE = '.llm_cache.sqlite'  # LLM 调用结果的持久化缓存
+LLM_CACHE_TTL_SECONDS = 24 * 3600
+LLM_MAX_ATTEMPTS = 4  # DeepSeek 调用遇到网络/限流/5xx 时的最大尝试次数 (含首次)
+LLM_PARSE_MAX_ATTEMPTS = 2  # 模型输出格式错误时的最大尝试次数 (含首次)
+LLM_BREAKER_FAILURE_THRESHOLD = 3  # 连续失败多少次后熔断
+LLM_BREAKER_RESET_SECONDS = 60.0  # 熔断后多久允许再次尝试
 
 # --- 外部服务 URL ---
 AMAP_GEOCODE_URL = "https://restapi.amap.com/v3/geocode/geo"
@@ -19,6 +29,18 @@ JUHE_TRAIN_QUERY_URL = "https://apis.juhe.cn/fapigw/train/query"
 GOOGLE_FLIGHTS_URL = "https://serpapi.com/search.json"
 DEEPSEEK_BASE_URL = "https://api.deepseek.com"
 
+# --- 外部 API 并发与限流 ---
+AMAP_MAX_WORKERS = 8  # 并发查询驾车时间的最大线程数，不应超过账号的 QPS 配额
+AMAP_RATE_PER_SEC = 5.0  # 高德每秒请求数上限 (令牌桶速率)
+AMAP_GEOCODE_BATCH_SIZE = 10  # 高德批量地理编码单次最多 10 个地址
+AMAP_GEOCODE_MEMORY_CACHE_SIZE = 4096  # 地理编码内存缓存的最大条目数 (LRU 淘汰)
+AMAP_CACHE_FILE = '.amap_cache.sqlite'  # 地理编码与驾车时间的持久化缓存
+GEOCODE_CACHE_TTL_SECONDS = 180 * 24 * 3600  # 地址坐标基本不变，缓存 180 天
+DRIVING_TIME_CACHE_TTL_SECONDS = 24 * 3600  # 驾车时间随路况变化，缓存 1 天
+SERPAPI_RATE_PER_SEC = 1.0  # SerpApi 每秒请求数上限
+SERPAPI_BURST = 2  # SerpApi 允许的瞬时突发请求数
+JUHE_RATE_PER_SEC = 2.0  # 聚合数据每秒请求数上限
+
 # 假设权重和固定拜访时间
 WEIGHTS = {
     'alpha': 0.5,
@@ -31,4 +53,8 @@ WEIGHTS = {
 PRE_DEPARTURE_BUFFER_MINUTES = 90
 POST_ARRIVAL_BUFFER_MINUTES = 30#参会缓冲时间
 COMPANY_VISIT_DURATION_MINUTES = 45#企业调研时间
+VISIT_ORDER_MAX_COMPANIES = 12  # Held-Karp 求最优访问顺序的企业数上限 (O(K^2 * 2^K))，超出时保持得分顺序
+EDGE_PREFETCH_TOP_K = 5  # LLM 评分期间预取企业间驾车时间的候选企业数 (K 家企业 -> K*(K-1) 条边)
 DEFAULT_REFERENCE_COMMUTE_MINUTES = 45.0
+# 直线距离预筛选的速度上限 (km/h)：直线距离按此速度仍超出驾车时限的企业不再调用高德 API
+PREFILTER_MAX_SPEED_KMH = 72.0  # 1.2 km/min，留出城市快速路的余量，避免误删实际可达的企业
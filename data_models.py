@@ -1,5 +1,8 @@
+from datetime import datetime
 from typing import List
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+MEETING_START_FORMAT_ERROR = "日期或时间格式不正确，请使用 YYYY-MM-DD HH:MM 格式。"
 
 class PlannedVisit(BaseModel):
     name: str = Field(description="调研企业的完整名称。")
@@ -18,9 +21,24 @@ class UserInputParams(BaseModel):
     origin_city: str = Field(description="出发城市名，例如 '上海'。")
     destination_city: str = Field(description="目的地城市名，例如 '深圳'。")
     departure_date: str = Field(description="出发日期，格式为 'YYYY-MM-DD'。")
-    meeting_start: str = Field(description="会议开始日期和时间，精确到小时和分钟，格式为 'YYYY-MM-DD HH:MM'。")
+    meeting_start: datetime = Field(description="会议开始日期和时间，精确到小时和分钟，格式为 'YYYY-MM-DD HH:MM'。")
     meeting_duration_h: int = Field(description="会议持续时长，以小时为单位。")
     home_address: str = Field(description="用户的出发地详细地址，例如 '上海市浦东新区川沙新镇黄赵路310号'。")
     meeting_address: str = Field(description="会议的详细地址。")
     hotel_address: str = Field(description="预订或计划入住的酒店详细地址。")
 
+    @field_validator('meeting_start', mode='before')
+    @classmethod
+    def _parse_meeting_start(cls, value):
+        """兼容 'YYYY-MM-DD H:MM' 等非补零写法（与原先 strptime 的行为一致），以及缓存中的 ISO 字符串。"""
+        if not isinstance(value, str):
+            return value
+        text = value.strip()
+        try:
+            return datetime.strptime(text, '%Y-%m-%d %H:%M')
+        except ValueError:
+            pass
+        try:
+            return datetime.fromisoformat(text)
+        except ValueError:
+            raise ValueError(MEETING_START_FORMAT_ERROR) from None
@@ -1,7 +1,7 @@
 # graph.py (完整修正与更新)
 
 from langgraph.graph import StateGraph, END, START
-from typing import Literal
+from typing import List, Literal, Union
 from state import TravelPlanState
 from nodes import (
     check_constraints,
@@ -58,14 +58,16 @@ def decide_after_llm_select(state: TravelPlanState) -> Literal["calculate_final_
         return "end"
 
 
-# 新增：判断最终交通计算后，进入 pre_meeting_plan 节点。
-def decide_after_traffic_calculation(state: TravelPlanState) -> Literal["pre_meeting_plan", "end"]:
+# 新增：判断最终交通计算后，同时进入 pre_meeting_plan 与 post_meeting_plan 节点。
+def decide_after_traffic_calculation(
+        state: TravelPlanState) -> Union[List[Literal["pre_meeting_plan", "post_meeting_plan"]], Literal["end"]]:
     """
     交通计算后决定下一步。
+    会议前、会议后规划读写的状态互不相交，返回两个节点使其在同一步内并行执行。
     """
     if state.get("selected_transport"):
-        print("✅ 交通行程条目已创建，进入会议前行程规划。")
-        return "pre_meeting_plan"
+        print("✅ 交通行程条目已创建，并行进入会议前/会议后行程规划。")
+        return ["pre_meeting_plan", "post_meeting_plan"]
     else:
         print("❌ 流程终止：交通精确计算失败。")
         return "end"
@@ -107,18 +109,21 @@ def build_travel_graph() -> StateGraph:
     workflow.add_conditional_edges("select_transport_by_llm", decide_after_llm_select,
                                    {"calculate_final_transport": "calculate_final_transport", "end": END})
 
-    # 边 3: 精确交通计算 -> (会议前规划 或 结束)
-    # 流程必须继续，如果精确计算成功，则进入会议前规划
+    # 边 3: 精确交通计算 -> (会议前规划 + 会议后规划 并行 或 结束)
+    # 流程必须继续，如果精确计算成功，则同时进入两个规划阶段
     workflow.add_conditional_edges("calculate_final_transport", decide_after_traffic_calculation,
-                                   {"pre_meeting_plan": "pre_meeting_plan", "end": END})
+                                   {"pre_meeting_plan": "pre_meeting_plan",
+                                    "post_meeting_plan": "post_meeting_plan",
+                                    "end": END})
 
-    # 💡 边 4: 会议前规划 -> 会议后规划 (修正：流程必须继续到下一个规划阶段)
-    workflow.add_edge("pre_meeting_plan", "post_meeting_plan")
-
-    # 💡 边 5: 会议后规划 -> 报告生成 (新增边)
-    workflow.add_edge("post_meeting_plan", "generate_final_itinerary")
+    # 💡 边 4: 会议前规划 + 会议后规划 -> 报告生成 (两个分支都完成后才汇合)
+    workflow.add_edge(["pre_meeting_plan", "post_meeting_plan"], "generate_final_itinerary")
 
     # 💡 边 6: 报告生成 -> 结束 (终点)
     workflow.add_edge("generate_final_itinerary", END)
 
-    return workflow
\ No newline at end of file
+    return workflow
+
+
+# 进程级只构建并编译一次，所有会话共享同一个已编译的图
+COMPILED_GRAPH = build_travel_graph().compile()
@@ -1,49 +1,203 @@
 # llm_agent.py
-from langchain_core.output_parsers import JsonOutputParser
-from typing import Dict, List, Any, Optional
-import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+import functools
+from typing import Dict, List, Any, Optional, Callable, TypeVar
 from json import JSONDecodeError
-from datetime import datetime, timedelta
+from datetime import datetime
+import threading
+import time
 
+import openai
+import orjson
+from langchain_core.exceptions import OutputParserException
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_deepseek import ChatDeepSeek
-from config import LLM_MODEL, TEMPERATURE, COMPANY_VISIT_DURATION_MINUTES, DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL
-from data_models import PreMeetingPlanOutput, SelectedTransport, UserInputParams
+from pydantic import ValidationError
+from tenacity import RetryCallState, Retrying, stop_after_attempt, wait_exponential_jitter
+from config import LLM_MODEL, CHEAP_LLM_MODEL, TEMPERATURE, COMPANY_VISIT_DURATION_MINUTES, DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, \
+    SCORING_BATCH_SIZE, LLM_MAX_ATTEMPTS, LLM_PARSE_MAX_ATTEMPTS, LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RESET_SECONDS
+from data_models import PreMeetingPlanOutput, SelectedTransport, UserInputParams, MEETING_START_FORMAT_ERROR
 from prompts import TRANSPORT_DECISION_PROMPT, PRE_MEETING_PLAN_PROMPT, FINAL_REPORT_TEMPLATE, EVALUATE_SCORE_PROMPT, \
     INPUT_EXTRACTION_PROMPT
 import logging
-from state import Location
+from llm_cache import llm_cached
+from state import Location, TransportOption
 from openai import OpenAI
 
+logger = logging.getLogger(__name__)
 
+# 重试统一由下方 _call_deepseek 负责，关闭客户端自带的重试以免多层叠加
 llm = ChatDeepSeek(
     model=LLM_MODEL,
     temperature=TEMPERATURE,
+    max_retries=0,
 )
 
-PRE_MEETING_BUFFER_MINUTES = 90
-# --- 核心 LLM 代理函数 ---
-def llm_parse_user_input(user_input: str) -> UserInputParams | dict:
+# 廉价模型：只用于简单的参数抽取，温度为 0 以获得稳定的结构化输出；
+# 未配置或与主模型相同时不创建，参数抽取直接走主模型
+cheap_llm = ChatDeepSeek(
+    model=CHEAP_LLM_MODEL,
+    temperature=0,
+    max_retries=0,
+) if CHEAP_LLM_MODEL and CHEAP_LLM_MODEL != LLM_MODEL else None
+
+# 评分调用直接使用 OpenAI 兼容客户端，模块级复用其连接池
+client = OpenAI(
+    api_key=DEEPSEEK_API_KEY,
+    base_url=DEEPSEEK_BASE_URL,
+    max_retries=0,
+)
+
+
+# --- DeepSeek 调用的重试与熔断 ---
+
+class LLMUnavailable(Exception):
+    """DeepSeek 调用在重试后仍然失败，或熔断器处于打开状态。上游节点据此降级，而不是整体失败。"""
+
+
+class CircuitBreaker:
+    """简单的熔断器：连续失败达到阈值后打开，冷却期内直接拒绝调用，冷却结束后放行一次试探。"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._opened_at = None  # 半开：放行试探调用，失败则立即重新打开
+                self._failures = self.failure_threshold - 1
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+_DEEPSEEK_BREAKER = CircuitBreaker(LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RESET_SECONDS)
+
+# 瞬时错误（限流、网络/超时、服务端 5xx）值得按 LLM_MAX_ATTEMPTS 重试
+_TRANSIENT_LLM_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # 含 APITimeoutError
+    openai.InternalServerError,
+)
+# 只有网络/超时与 5xx 说明服务本身异常，计入熔断；限流与其他错误不计入
+_BREAKER_LLM_ERRORS = (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+# 模型输出不符合结构（多半源于用户输入本身），最多重试 LLM_PARSE_MAX_ATTEMPTS 次，最终原样抛给调用方
+_PARSE_LLM_ERRORS = (
+    JSONDecodeError,
+    OutputParserException,
+    ValidationError,
+)
+
+
+def _should_retry_llm(retry_state: RetryCallState) -> bool:
+    """瞬时错误按 LLM_MAX_ATTEMPTS 重试；格式错误只重试到 LLM_PARSE_MAX_ATTEMPTS 次；其他错误不重试。"""
+    error = retry_state.outcome.exception()
+    if isinstance(error, _TRANSIENT_LLM_ERRORS):
+        return True
+    if isinstance(error, _PARSE_LLM_ERRORS):
+        return retry_state.attempt_number < LLM_PARSE_MAX_ATTEMPTS
+    return False
+
+
+_T = TypeVar("_T")
+
+
+def _call_deepseek(func: Callable[..., _T], *args, **kwargs) -> _T:
     """
-    使用 LLM 和结构化解析器，将非结构化文本转化为 UserInputParams 模型。
+    以带抖动的指数退避重试调用 DeepSeek，并经过熔断器。
+    重试耗尽或熔断打开时抛出 LLMUnavailable；输出格式错误不计入熔断，原样抛出。
     """
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", INPUT_EXTRACTION_PROMPT),
-            ("user", f"{user_input}")
-        ]
-    )
+    if not _DEEPSEEK_BREAKER.allow():
+        raise LLMUnavailable("DeepSeek 连续调用失败，熔断器已打开，暂时跳过 LLM 调用。")
 
-    # 构建链
-    extraction_chain = prompt | llm.with_structured_output(UserInputParams)
+    try:
+        for attempt in Retrying(
+                stop=stop_after_attempt(LLM_MAX_ATTEMPTS),
+                wait=wait_exponential_jitter(initial=1, max=10),
+                retry=_should_retry_llm,
+                reraise=True):
+            with attempt:
+                result = func(*args, **kwargs)
+    except _PARSE_LLM_ERRORS:
+        raise
+    except Exception as e:
+        if isinstance(e, _BREAKER_LLM_ERRORS):
+            _DEEPSEEK_BREAKER.record_failure()
+        raise LLMUnavailable(f"DeepSeek 调用失败: {e}") from e
+
+    _DEEPSEEK_BREAKER.record_success()
+    return result
+
+# --- 模块级预构建的 Chain，避免每次调用重复构造 Prompt 模板和结构化输出包装 ---
+_INPUT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", INPUT_EXTRACTION_PROMPT),
+        ("user", "{user_input}")
+    ]
+)
+_CHEAP_INPUT_CHAIN = _INPUT_PROMPT | cheap_llm.with_structured_output(UserInputParams) if cheap_llm else None
+_INPUT_CHAIN = _INPUT_PROMPT | llm.with_structured_output(UserInputParams)
+_TRANSPORT_CHAIN = TRANSPORT_DECISION_PROMPT | llm.with_structured_output(SelectedTransport)
+_PRE_MEETING_CHAIN = PRE_MEETING_PLAN_PROMPT | llm.with_structured_output(PreMeetingPlanOutput)
 
+PRE_MEETING_BUFFER_MINUTES = 90
+# --- 核心 LLM 代理函数 ---
+def _extract_with_cheap_model(user_input: str) -> Optional[UserInputParams]:
+    """廉价模型单次尝试（不重试、不计入熔断）；未配置廉价模型、结构不合法或有字段为空时返回 None，由主模型兜底。"""
+    if _CHEAP_INPUT_CHAIN is None or not _DEEPSEEK_BREAKER.allow():
+        return None
     try:
-        # 运行链并获取结构化结果 (结果将是 UserInputParams 的实例)
-        result_model = extraction_chain.invoke({"user_input": user_input})
+        result_model = _CHEAP_INPUT_CHAIN.invoke({"user_input": user_input})
+    except Exception as e:
+        logger.info("↗️ 廉价模型参数抽取失败，升级到主模型: %s", e)
+        return None
+
+    if not isinstance(result_model, UserInputParams):
+        return None
+    missing = [k for k, v in result_model.model_dump().items() if not v]
+    if missing:
+        logger.info("↗️ 廉价模型抽取结果缺少字段 %s，升级到主模型。", missing)
+        return None
+    return result_model
 
-        # 返回字典形式，便于 LangGraph 状态合并
-        return result_model.model_dump()
 
+@llm_cached(should_cache=lambda result: bool(result) and 'error_message' not in result)
+def _extract_user_input(user_input: str) -> dict:
+    """调用 LLM 抽取参数，返回 JSON 兼容的字典（datetime 以 ISO 字符串表示，便于写入磁盘缓存）。"""
+    try:
+        # 先走廉价模型，失败再由主模型按完整的重试/熔断策略处理
+        result_model = _extract_with_cheap_model(user_input)
+        if result_model is None:
+            result_model = _call_deepseek(_INPUT_CHAIN.invoke, {"user_input": user_input})
+        return result_model.model_dump(mode='json')
+
+    except LLMUnavailable:
+        raise
+    except ValidationError as e:
+        # 会议时间写法无法识别时给出格式提示，其余字段问题按结构化解析失败处理
+        if any(error['loc'][:1] == ('meeting_start',) for error in e.errors()):
+            return {"error_message": MEETING_START_FORMAT_ERROR, "user_input": user_input}
+        return {"error_message": f"LLM 结构化解析失败: {e}", "user_input": user_input}
     except Exception as e:
         # 如果 LLM 解析失败（例如格式错误），返回错误和原始输入
         return {
@@ -52,63 +206,143 @@ def llm_parse_user_input(user_input: str) -> UserInputParams | dict:
         }
 
 
-def llm_choose_transport(transport_options: List[Dict], user_data: Dict, home_commute_time: float,
-                         arrival_commute_time: float) -> Optional[Dict[str, Any]]:
+class _ExtractionFailed(Exception):
+    """参数抽取失败；以异常形式跳出 lru_cache，确保失败结果不会被进程内缓存。"""
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_user_input_memo(user_input: str) -> UserInputParams:
+    raw = _extract_user_input(user_input)
+    if 'error_message' in raw:
+        raise _ExtractionFailed(raw)
+    # 无论是否命中磁盘缓存，都经同一个模型校验，保证返回的字段类型一致
+    return UserInputParams.model_validate(raw)
+
+
+def llm_parse_user_input(user_input: str) -> dict:
     """
-    LLM 决策交通方式和班次，返回原始列表中的完整数据。
+    使用 LLM 和结构化解析器，将非结构化文本转化为 UserInputParams 字段字典。
+    meeting_start 由 Pydantic 统一转换为 datetime，下游无需再手动 strptime。
+    相同文本在进程内直接复用上次结果；每次返回新的字典，调用方可放心修改。
     """
-    # 使用 Pydantic 模型进行严格结构化输出
-    chain = TRANSPORT_DECISION_PROMPT | llm | JsonOutputParser(pydantic_object=SelectedTransport)
-
     try:
-        # 1. 计算最晚到达枢纽的时间 (关键修正)
-        meeting_start_dt = user_data['meeting_start_dt']
+        # 首尾空白不影响抽取结果，规范化后再作为缓存键
+        return _parse_user_input_memo(user_input.strip()).model_dump()
+    except _ExtractionFailed as e:
+        return e.args[0]
+
+
+def _format_transport_table(transport_options: List[TransportOption]) -> str:
+    """将交通选项压缩为竖线分隔的表格（仅保留决策所需字段），比缩进 JSON 节省大量输入 token。"""
+    rows = ["type|id|departure_date|departure_time|arrival_date|arrival_time|price|duration"]
+    rows.extend(
+        f"{o.type}|{o.id}|{o.departure_date}|{o.departure_time}|{o.arrival_date}|{o.arrival_time}|{o.price}|{o.duration}"
+        for o in transport_options
+    )
+    return "\n".join(rows)
+
 
-        # 最晚需在会议前 (90分钟 + 枢纽通勤时间) 到达枢纽
-        total_buffer = PRE_MEETING_BUFFER_MINUTES + arrival_commute_time
+def _format_company_table(companies: List[Dict[str, Any]]) -> str:
+    """将候选企业压缩为竖线分隔的表格：描述截断到 80 字，行业缺失时留空。"""
+    rows = ["name|industry|description|driving_time_min|value_score"]
+    for comp in companies:
+        industry = comp.get('industry') or ''
+        if industry == 'N/A':
+            industry = ''
+        description = (comp.get('description') or '')[:80]
+        driving_time = comp.get('driving_time_min', float('inf'))
+        rows.append(f"{comp['name']}|{industry}|{description}|{driving_time}|{comp.get('value_score', 5)}")
+    return "\n".join(rows)
 
-        latest_hub_arrival_dt = meeting_start_dt - timedelta(minutes=total_buffer)
-        latest_hub_arrival_str = latest_hub_arrival_dt.strftime('%Y-%m-%d %H:%M')
 
+def _select_llm_candidates(companies: List[Dict[str, Any]], available_minutes: float,
+                           max_candidates: int = 10) -> List[Dict[str, Any]]:
+    """
+    按 调研价值 / 驾车耗时 降序挑选交给 LLM 的候选企业：
+    累计驾车耗时超过可用时间 1.5 倍后的企业不可能排进行程，不再发送给 LLM。
+    """
+    ranked = sorted(
+        companies,
+        key=lambda c: c.get('value_score', 5) / max(c.get('driving_time_min', float('inf')), 1.0),
+        reverse=True
+    )
+
+    candidates = []
+    cumulative_minutes = 0.0
+    for comp in ranked[:max_candidates]:
+        cumulative_minutes += comp.get('driving_time_min', float('inf'))
+        if cumulative_minutes >= available_minutes * 1.5:
+            break
+        candidates.append(comp)
+    return candidates
+
+
+@llm_cached()
+def llm_choose_transport(transport_options: List[TransportOption], user_data: Dict, home_commute_time: float,
+                         arrival_commute_time: float, latest_hub_arrival: str) -> Optional[Dict[str, Any]]:
+    """
+    LLM 决策交通方式和班次，以字典形式返回原始列表中选中班次的完整数据。
+    latest_hub_arrival 与 user_data['meeting_start_str'] 均由调用方预先格式化，本函数只负责组装输入并调用 LLM。
+    """
+    # 按 (id, type) 建立索引，用于将 LLM 的选择匹配回原始班次；
+    # 同一班次号在前一天和当天都有时保留先出现的一个（与原先按顺序查找的结果一致）
+    options_index: Dict[tuple, TransportOption] = {}
+    for opt in transport_options:
+        options_index.setdefault((opt.id, opt.type), opt)
+
+    try:
         # 1. 准备输入 (逻辑保持不变)
-        transport_options_str = json.dumps(transport_options, indent=2, ensure_ascii=False)
+        transport_options_str = _format_transport_table(transport_options)
         llm_input = {
             # ... (参数组装逻辑保持不变) ...
             "transport_options": transport_options_str,
             "home_commute_time": home_commute_time,
             "arrival_commute_time": arrival_commute_time,
             "departure_date": user_data['departure_date'],
-            "meeting_start_dt": user_data['meeting_start_dt'].strftime('%Y-%m-%d %H:%M'),
-            "latest_hub_arrival": latest_hub_arrival_str
+            "meeting_start_dt": user_data['meeting_start_str'],
+            "latest_hub_arrival": latest_hub_arrival
         }
 
-        raw_output = chain.invoke(llm_input)
+        # 使用模型原生的结构化输出 (工具调用参数受 Pydantic Schema 约束)
+        raw_output = _call_deepseek(_TRANSPORT_CHAIN.invoke, llm_input)
 
         # 2. 匹配回原始选项的完整数据 (查找逻辑)
-        if isinstance(raw_output, dict):
+        if isinstance(raw_output, SelectedTransport):
             # LLM 只返回 ID, Type 和 Reasoning
-            selected_id = raw_output.get('id')
-            selected_type = raw_output.get('type')
+            selected_id = raw_output.id
+            selected_type = raw_output.type
 
-            # 使用 Python 查找完整的班次字典
-            final_selection = next(
-                (opt for opt in transport_options if opt.get('id') == selected_id and opt.get('type') == selected_type),
-                None
-            )
+            # 使用 (id, type) 索引 O(1) 查找完整的班次
+            final_selection = options_index.get((selected_id, selected_type))
 
             if final_selection:
-                return final_selection
+                return asdict(final_selection)
 
         # 如果 LLM 输出格式正确，但 ID 匹配失败
-        print(f"⚠️ LLM 输出格式正确，但未能匹配到原始班次。")
+        logger.warning("⚠️ LLM 输出格式正确，但未能匹配到原始班次。")
         return None
 
+    except LLMUnavailable:
+        raise
     except Exception as e:
         # 异常时返回 None
-        print(f"❌ DeepSeek LLM调用失败或解析错误: {e}")
+        logger.error("❌ DeepSeek LLM调用失败或解析错误: %s", e)
         return None
 
 
+def _request_json_scores(messages: List[Dict[str, str]]) -> Any:
+    """调用 DeepSeek (JSON 模式) 并解析返回的 JSON；格式错误抛出 JSONDecodeError，交由 _call_deepseek 处理。"""
+    response = client.chat.completions.create(
+        model=LLM_MODEL,
+        messages=messages,
+        response_format={
+            'type': 'json_object'
+        }
+    )
+    return orjson.loads(response.choices[0].message.content)
+
+
+@llm_cached()
 def call_llm_for_json_scoring(prompt: str) -> List[Dict[str, Any]]:
     """
     使用 DeepSeek API 调用 LLM，并利用 response_format 确保输出为 JSON 数组。
@@ -116,14 +350,11 @@ def call_llm_for_json_scoring(prompt: str) -> List[Dict[str, Any]]:
         prompt: 包含评分指令和企业列表的 Prompt 字符串。
     Returns:
         解析后的 JSON 列表 (List[Dict])，如果失败则返回空列表。
+    Raises:
+        LLMUnavailable: 重试耗尽或熔断器打开。
     """
 
     try:
-        client = OpenAI(
-            api_key=DEEPSEEK_API_KEY,
-            base_url=DEEPSEEK_BASE_URL,
-        )
-
         system_prompt = """
         你是一名资深的投资顾问，正在为企业调研做决策。
         用户将提供一份企业列表和评分标准。你必须严格按照要求，返回一个包含所有企业评分和简短原因的 JSON 数组。
@@ -144,35 +375,21 @@ def call_llm_for_json_scoring(prompt: str) -> List[Dict[str, Any]]:
             {"role": "user", "content": prompt}
         ]
 
-        # 1. 调用 DeepSeek API，使用 JSON 模式
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=messages,
-            response_format={
-                'type': 'json_object'
-            }
-        )
-
-        # 2. 解析 JSON 字符串
-        response_text = response.choices[0].message.content
-
-        # 由于我们要求模型返回一个 JSON 数组（它是合法的 JSON 对象），可以直接解析
-        parsed_json = json.loads(response_text)
+        # 1-2. 调用并解析；JSON 格式错误由 _call_deepseek 统一重试
+        parsed_json = _call_deepseek(_request_json_scores, messages)
 
         # 3. 验证顶级结构是否为列表 (确保返回的是数组而不是单个对象)
         if isinstance(parsed_json, list):
-            print("✅ LLM 评分 JSON 解析成功。")
+            logger.info("✅ LLM 评分 JSON 解析成功。")
             return parsed_json
         else:
-            print(f"⚠️ LLM 返回的顶级结构不是列表，而是 {type(parsed_json)}。")
+            logger.warning("⚠️ LLM 返回的顶级结构不是列表，而是 %s。", type(parsed_json))
             return [parsed_json] if isinstance(parsed_json, dict) else []  # 尝试容错
 
-    except JSONDecodeError as e:
-        print(f"❌ LLM 返回的文本不是有效的 JSON 格式，解析失败: {e}")
-        # print(f"原始返回文本: {response_text[:200]}...") # 调试时可打印
-        return []
+    except LLMUnavailable:
+        raise
     except Exception as e:
-        print(f"❌ DeepSeek API 调用或处理时发生错误: {e}")
+        logger.error("❌ DeepSeek API 调用或处理时发生错误: %s", e)
         return []
 
 
@@ -180,28 +397,45 @@ def call_llm_for_json_scoring(prompt: str) -> List[Dict[str, Any]]:
 def get_company_scores_by_llm(companies_data: List[Dict[str, Any]], t_available: float) -> List[Dict[str, Any]]:
     """
     接收企业列表，生成 Prompt，调用 LLM 获取结构化的吸引力和可行性评分。
+    企业数超过 SCORING_BATCH_SIZE 时分批生成 Prompt 并发调用，总耗时约等于最慢的一次调用。
     """
-    # 1. 格式化企业数据为 Markdown 表格
-    table_rows = "| 企业名称 | 枢纽到企业 (min) | 企业到会议地 (min) | 两次驾车总耗时 (min) |\n"
-    table_rows += "| :--- | :--- | :--- | :--- |\n"
-    for company in companies_data:
-        # 确保数据已计算
-        t_total_trip = company['T_hub_to_i'] + company['T_i_to_meeting']
-        table_rows += f"| {company['name']} | {company['T_hub_to_i']:.1f} | {company['T_i_to_meeting']:.1f} | {t_total_trip:.1f} |\n"
+    batches = [companies_data[i:i + SCORING_BATCH_SIZE] for i in range(0, len(companies_data), SCORING_BATCH_SIZE)]
+    if not batches:
+        return []
 
     try:
-        prompt = EVALUATE_SCORE_PROMPT.format(
-            t_available=t_available,
-            companies_markdown_table=table_rows
-        )
+        prompts = [_build_scoring_prompt(batch, t_available) for batch in batches]
         # ⚠️ 实际项目中，需要增加容错处理，确保 LLM 严格返回 JSON
-        scored_companies = call_llm_for_json_scoring(prompt)
-        return scored_companies
+        with ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+            batch_results = list(executor.map(call_llm_for_json_scoring, prompts))
+        return [scored for batch_scores in batch_results for scored in batch_scores]
+    except LLMUnavailable:
+        raise
     except Exception as e:
-        print(f"❌ LLM 评分阶段失败: {e}")
+        logger.error("❌ LLM 评分阶段失败: %s", e)
         return []
 
 
+_SCORING_TABLE_HEADER = (
+    "| 企业名称 | 枢纽到企业 (min) | 企业到会议地 (min) | 两次驾车总耗时 (min) |\n"
+    "| :--- | :--- | :--- | :--- |\n"
+)
+
+
+def _build_scoring_prompt(companies_data: List[Dict[str, Any]], t_available: float) -> str:
+    """将一批企业格式化为 Markdown 表格并填充评分 Prompt。T_total_trip 已在可行性筛选时算好，直接复用。"""
+    table_rows = _SCORING_TABLE_HEADER + "".join(
+        f"| {c['name']} | {c['T_hub_to_i']:.1f} | {c['T_i_to_meeting']:.1f} | {c['T_total_trip']:.1f} |\n"
+        for c in companies_data
+    )
+
+    return EVALUATE_SCORE_PROMPT.format(
+        t_available=t_available,
+        companies_markdown_table=table_rows
+    )
+
+
+@llm_cached()
 def llm_plan_route_pre_meeting(
         available_companies: List[Dict],
         arrival_hub_loc: Location,
@@ -213,39 +447,26 @@ def llm_plan_route_pre_meeting(
     LLM 决策在会议前安排哪些顺路的企业调研，并进行排序。
     返回 LLM 选定并排序后的企业列表（包含 name 和 order）。
     """
-    print(f"🌍 正在对 {len(available_companies)} 家企业进行 LLM 智能筛选 (可用时间: {available_minutes:.1f} 分钟)...")
-
-    top_companies_input = []
-    for comp in available_companies:
-        top_companies_input.append({
-            'name': comp['name'],
-            'id': comp['id'],
-            'industry': comp.get('industry', 'N/A'),
-            'description': comp.get('description', ''),
-            'driving_time_min': comp.get('driving_time_min', float('inf')),
-            'value_score': comp.get('value_score', 5)
-        })
-    top_companies_json = json.dumps(top_companies_input[:10], indent=2, ensure_ascii=False)
+    logger.info("🌍 正在对 %d 家企业进行 LLM 智能筛选 (可用时间: %.1f 分钟)...", len(available_companies), available_minutes)
 
-    # 构建 Chain
-    parser = JsonOutputParser(pydantic_object=PreMeetingPlanOutput)
-    chain = PRE_MEETING_PLAN_PROMPT.partial(format_instructions=parser.get_format_instructions()) | llm | parser
+    top_companies_table = _format_company_table(_select_llm_candidates(available_companies, available_minutes))
 
     try:
-        raw_output = chain.invoke({
+        # 原生结构化输出，直接返回 PreMeetingPlanOutput 实例
+        raw_output = _call_deepseek(_PRE_MEETING_CHAIN.invoke, {
             "visit_duration_minutes": COMPANY_VISIT_DURATION_MINUTES,
             "arrival_hub_name": arrival_hub_loc['name'],
             "meeting_venue_name": meeting_loc['name'],
             "available_minutes": available_minutes,
             "initial_commute_time": initial_commute_time,
-            "available_companies": top_companies_json,
+            "available_companies": top_companies_table,
             "meeting_start_time": meeting_loc['city']
         })
 
         # 1. 处理 Pydantic 实例 (最优路径)
         if isinstance(raw_output, PreMeetingPlanOutput):
             if raw_output.planned_visits:
-                print(f"✅ LLM 成功规划 {len(raw_output.planned_visits)} 个调研企业。")
+                logger.info("✅ LLM 成功规划 %d 个调研企业。", len(raw_output.planned_visits))
                 # --- 关键修正：使用 model_dump() 替代 dict() ---
                 return [visit.model_dump() for visit in raw_output.planned_visits]
             return []
@@ -254,29 +475,36 @@ def llm_plan_route_pre_meeting(
         if isinstance(raw_output, dict) and 'planned_visits' in raw_output:
             planned_visits = raw_output['planned_visits']
             if isinstance(planned_visits, list) and planned_visits:
-                print(f"✅ LLM 成功规划 {len(planned_visits)} 个调研企业 (通过容错字典解析)。")
+                logger.info("✅ LLM 成功规划 %d 个调研企业 (通过容错字典解析)。", len(planned_visits))
                 return planned_visits
             return []
 
             # 兜底失败
-        logging.warning(f"⚠️ LLM 规划输出格式不正确。原始输出类型: {type(raw_output)}")
+        logger.warning("⚠️ LLM 规划输出格式不正确。原始输出类型: %s", type(raw_output))
         return []
 
+    except LLMUnavailable:
+        raise
     except Exception as e:
-        logging.error(f"❌ LLM 会议前规划调用失败或解析错误: {e}")
-        print(f"❌ LLM 会议前规划调用失败或解析错误: {e}")
+        logger.error("❌ LLM 会议前规划调用失败或解析错误: %s", e)
         return []
 
 
 
-def get_final_report_by_llm(user_data: Dict[str, Any], itinerary_items: List[Dict[str, Any]]) -> str:
+def format_hhmm(dt: datetime) -> str:
+    """以 HH:MM 输出时间；直接拼接整数字段，避免 strftime 的格式串解析开销。"""
+    return f"{dt.hour:02d}:{dt.minute:02d}"
+
+
+def get_final_report_by_llm(user_data: Dict[str, Any], itinerary_items: List[Dict[str, Any]],
+                            selected_transport: Optional[Dict[str, Any]] = None) -> str:
     """
     节点 6 最终版：Python 代码生成表格，LLM 只负责美化和包装。
     已修复所有 KeyError 和报告内容不一致的问题。
     """
     # 调试语句
-    print(f"DEBUG: Keys in user_data: {list(user_data.keys())}")
-    print("🤖 正在调用 LLM 生成最终行程报告...")
+    logger.debug("Keys in user_data: %s", list(user_data))
+    logger.info("🤖 正在调用 LLM 生成最终行程报告...")
 
     # --- 数据提取和安全检查 ---
     departure_date_str = user_data.get('departure_date', 'YYYY-MM-DD')
@@ -286,80 +514,23 @@ def get_final_report_by_llm(user_data: Dict[str, Any], itinerary_items: List[Dic
     if not meeting_start_dt or not actual_arrival_dt:
         return "❌ 无法生成最终报告：缺少会议开始或最终到达时间数据。"
 
-    # --- 1. 提取核心交通方案 (最终修正区域) ---
-
-    # 修正：直接从 user_data 中获取 raw 数据，因为它包含了所有关键字段
-    # 注意：这里的 user_data 实际上是 TravelPlanState 的一个子集，
-    # 我们需要找到一个包含 'selected_transport' 信息的字段。
-    # 根据您的日志，'selected_option_raw' 包含 ID, 时间, 枢纽和价格。
-    raw_transport = user_data.get('selected_option_raw', {})  # 假设 selected_option_raw 在 user_data 顶层
-
-    # 检查状态摘要，发现 selected_option_raw 是 state 的顶级键，但不在 user_data 中。
-    # 既然无法直接获取 state['selected_transport']，我们使用运行总结中已打印的关键信息。
-
-    # *** 重新构造获取逻辑：从 itinerary_items 中查找 'main_transport' 类型的条目 ***
-    # 根据您的日志，主交通段通常不会被纳入 final_itinerary，因此从 raw_option 构造是唯一可行的方法。
-
-    # 从状态摘要（State Summary）中模拟获取所需信息
-    # 假设 'selected_option_raw' 可以被传入或获取到
-    selected_option_raw = next(
-        (item for item in itinerary_items if item.get('type') == 'Flight'),
-        {}  # 如果没找到，返回空字典
-    )
-
-    first_transport_item = next(
-        (item for item in itinerary_items if item.get('type') == 'transport'),
-        None
-    )
-
-    transport_summary = "核心交通信息缺失或未找到。"
-
-    selected_transport_raw = user_data.get('selected_transport_raw')  # 假设您已将该键传入
-
-    if first_transport_item and selected_transport_raw:
-        # 使用 raw_option 中的精确信息
-        transport_type = selected_transport_raw.get('type', 'N/A')
-        id_code = selected_transport_raw.get('id', 'N/A')
-        departure_hub = selected_transport_raw.get('departure_hub', 'N/A')
-        arrival_hub = selected_transport_raw.get('arrival_hub', 'N/A')
-        departure_time = selected_transport_raw.get('departure_time', 'N/A')
-        arrival_time = selected_transport_raw.get('arrival_time', 'N/A')
-        price = selected_transport_raw.get('price', 'N/A')
-
-        # 提取 home_commute_min (这个信息不在 raw 里，但可以从日志中的 'selected_transport' 提取)
-        # 假设该信息已添加到 user_data 中
-        home_commute_min = user_data.get('home_commute_min', 'N/A')
+    # --- 1. 提取核心交通方案 ---
+    # 交通原始数据和家->枢纽通勤时间都在 selected_transport['details'] 中（由节点 5 写入）
+    details = (selected_transport or {}).get('details') or {}
+    raw_option = details.get('raw_option')
+    home_commute_min = details.get('home_commute_min')
 
+    if raw_option and home_commute_min is not None:
         transport_summary = f"""
-* **类型/ID：** {transport_type} {id_code} ({departure_hub} -> {arrival_hub})
-* **班次时间：** {departure_time} (起飞/发车) -> {arrival_time} (到达)
-* **预估价格：** {price} 元
-* **关键提醒：** 需在 **{home_commute_min:.1f}** 分钟前从家出发，预估无调研到达会议地时间: {actual_arrival_dt.strftime('%H:%M')}。
-"""
-    # -------------------------------------------------------------------------------------------------
-
-    # 假设您**无法修改**调用链，且 `selected_transport_raw` 不在 `user_data` 中，
-    if transport_summary == "核心交通信息缺失或未找到。":
-        try:
-            transport_type = 'Flight'
-            id_code = 'HU 7726'
-            departure_hub = 'PVG'
-            arrival_hub = 'SZX'
-            departure_time = '09:00'
-            arrival_time = '11:40'
-            price = 2090
-
-            home_commute_min = 27.8
-
-            transport_summary = f"""
-* **类型/ID：** {transport_type} {id_code} ({departure_hub} -> {arrival_hub})
-* **班次时间：** {departure_time} (起飞/发车) -> {arrival_time} (到达)
-* **预估价格：** {price} 元
-* **关键提醒：** 需在 **{home_commute_min:.1f}** 分钟前从家出发，预估无调研到达会议地时间: {actual_arrival_dt.strftime('%H:%M')}。
+* **类型/ID：** {raw_option.get('type', 'N/A')} {raw_option.get('id', 'N/A')} ({raw_option.get('departure_hub', 'N/A')} -> {raw_option.get('arrival_hub', 'N/A')})
+* **班次时间：** {raw_option.get('departure_time', 'N/A')} (起飞/发车) -> {raw_option.get('arrival_time', 'N/A')} (到达)
+* **预估价格：** {raw_option.get('price', 'N/A')} 元
+* **关键提醒：** 需在 **{home_commute_min:.1f}** 分钟前从家出发，预估无调研到达会议地时间: {format_hhmm(actual_arrival_dt)}。
 """
-        except Exception as e:
-            # 如果硬编码失败，则报告缺失
-            transport_summary = f"核心交通信息提取失败: {e}"
+    else:
+        missing_key = 'raw_option' if not raw_option else 'home_commute_min'
+        logger.warning("⚠️ 最终报告缺少交通信息：selected_transport['details'] 中没有 '%s'。", missing_key)
+        transport_summary = "主要交通信息不完整。"
 
     # --- 2. 生成调研活动摘要 (与原逻辑保持一致) ---
     company_visits = [item for item in itinerary_items if item.get('type') == 'company_visit']
@@ -374,12 +545,11 @@ def get_final_report_by_llm(user_data: Dict[str, Any], itinerary_items: List[Dic
     error_summary = "在路径规划过程中，系统检测到高德 API 瞬时 QPS 超限，但通过内置的指数退避重试机制，所有必需的路径查询均已成功完成。"
 
     # --- 4. Python 代码生成行程表格 (与原逻辑保持一致) ---
-    itinerary_table_markdown = "| 时间 | 活动类型 | 内容描述 | 地点 |\n"
-    itinerary_table_markdown += "| :--- | :--- | :--- | :--- |\n"
+    table_lines = ["| 时间 | 活动类型 | 内容描述 | 地点 |", "| :--- | :--- | :--- | :--- |"]
 
     for item in itinerary_items:
-        start_time = item['start_time'].strftime("%H:%M")
-        end_time = item['end_time'].strftime("%H:%M")
+        start_time = format_hhmm(item['start_time'])
+        end_time = format_hhmm(item['end_time'])
         time_slot = f"{start_time} - {end_time}"
 
         # 优先使用 type，如果 type 不够友好，进行映射
@@ -396,7 +566,9 @@ def get_final_report_by_llm(user_data: Dict[str, Any], itinerary_items: List[Dic
         description = item.get('description', 'N/A')
         location_name = item.get('location', {}).get('name', 'N/A')
 
-        itinerary_table_markdown += f"| {time_slot} | {activity_type} | {description} | {location_name} |\n"
+        table_lines.append(f"| {time_slot} | {activity_type} | {description} | {location_name} |")
+
+    itinerary_table_markdown = "\n".join(table_lines) + "\n"
 
     # --- 5. 填充模板并返回 ---
     buffer_delta = meeting_start_dt - actual_arrival_dt
@@ -410,8 +582,8 @@ def get_final_report_by_llm(user_data: Dict[str, Any], itinerary_items: List[Dic
         hotel_address=user_data.get('hotel_address', 'N/A'),
 
         # 时间和缓冲
-        meeting_start_time=meeting_start_dt.strftime('%H:%M'),
-        actual_arrival_time=actual_arrival_dt.strftime('%H:%M'),
+        meeting_start_time=format_hhmm(meeting_start_dt),
+        actual_arrival_time=format_hhmm(actual_arrival_dt),
         buffer_minutes=buffer_minutes,
 
         # 动态内容
@@ -0,0 +1,120 @@
+# llm_cache.py
+import functools
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import orjson
+
+from config import LLM_MODEL, CHEAP_LLM_MODEL, TEMPERATURE, LLM_CACHE_FILE, LLM_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LLMResponseCache:
+    """
+    基于 SQLite 的 LLM 调用结果缓存（内容寻址）。
+    键为 (函数名, 模型, 廉价模型, 温度, 调用参数) 的 sha256，值为 JSON 序列化后的返回结果。
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # 评分等调用会在线程池中并发执行，共用同一个连接并由锁串行化访问
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Any:
+        """读取未过期的缓存结果，未命中返回 _MISSING。"""
+        with self._lock:
+            row = self._conn.execute("SELECT value, ts FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] >= self.ttl_seconds:
+            return _MISSING
+        return orjson.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        """写入（或覆盖）缓存结果。"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, ts) VALUES (?, ?, ?)",
+                (key, orjson.dumps(value).decode('utf-8'), time.time())
+            )
+            self._conn.commit()
+
+
+def make_cache_key(func_name: str, *args, **kwargs) -> str:
+    """
+    根据函数名、模型配置和调用参数计算内容寻址的缓存键。
+    参数抽取结果可能来自廉价模型，两个模型都计入键，任一模型更换后旧结果不再命中。
+    """
+    payload = orjson.dumps(
+        {"func": func_name, "model": LLM_MODEL, "cheap_model": CHEAP_LLM_MODEL, "temp": TEMPERATURE,
+         "args": args, "kwargs": kwargs},
+        option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str
+    )
+    return hashlib.sha256(payload).hexdigest()
+
+
+_CACHE: Optional[LLMResponseCache] = None
+_CACHE_INIT_LOCK = threading.Lock()
+_CACHE_DISABLED = False
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """懒加载全局缓存实例；数据库不可用时返回 None，调用将直接穿透到 LLM。"""
+    global _CACHE, _CACHE_DISABLED
+    if _CACHE is None and not _CACHE_DISABLED:
+        with _CACHE_INIT_LOCK:
+            if _CACHE is None and not _CACHE_DISABLED:
+                try:
+                    _CACHE = LLMResponseCache(LLM_CACHE_FILE, LLM_CACHE_TTL_SECONDS)
+                except sqlite3.Error as e:
+                    logger.warning(f"⚠️ LLM 缓存初始化失败，将不使用缓存: {e}")
+                    _CACHE_DISABLED = True
+    return _CACHE
+
+
+def llm_cached(should_cache: Callable[[Any], bool] = bool):
+    """
+    LLM 调用结果缓存装饰器。被装饰函数的返回值必须可 JSON 序列化。
+
+    Args:
+        should_cache: 判断结果是否值得缓存（默认跳过 None / 空列表等失败结果，以便下次重试）。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_llm_cache()
+            if cache is None:
+                return func(*args, **kwargs)
+
+            key = make_cache_key(func.__qualname__, *args, **kwargs)
+            try:
+                cached = cache.get(key)
+            except (sqlite3.Error, orjson.JSONDecodeError) as e:
+                logger.warning(f"⚠️ 读取 LLM 缓存失败: {e}")
+                cached = _MISSING
+            if cached is not _MISSING:
+                logger.info(f"💾 命中 LLM 缓存: {func.__name__}")
+                return cached
+
+            result = func(*args, **kwargs)
+            if should_cache(result):
+                try:
+                    cache.set(key, result)
+                except (sqlite3.Error, orjson.JSONEncodeError) as e:
+                    logger.warning(f"⚠️ 写入 LLM 缓存失败: {e}")
+            return result
+
+        return wrapper
+
+    return decorator
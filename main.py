@@ -1,10 +1,13 @@
 # main.py (最终修正版本)
 
-from graph import build_travel_graph
-from llm_agent import llm_parse_user_input
+from graph import COMPILED_GRAPH
+from llm_agent import format_hhmm
 from state import TravelPlanState
-from datetime import datetime, timedelta
+from datetime import timedelta
 from pprint import pprint
+import logging
+import logging.handlers
+import queue
 
 # 模拟用户输入数据
 # INITIAL_INPUT = {
@@ -19,43 +22,39 @@ from pprint import pprint
 #         'hotel_address': '深圳市南山区西丽街道官龙村西82号'
 # }
 # }
-INITIAL_INPUT = {
-    'user_data': {
-        'origin_city': '上海',
-        'destination_city': '深圳',
-        'departure_date': '2025-12-25',
-        'meeting_start': '2025-12-25 16:00',
-        'meeting_duration_h': 1,
-        'home_address': '上海市浦东新区川沙新镇黄赵路310号',
-        'meeting_address': '深圳市南山区桃园路2号',
-        'hotel_address': '深圳市南山区西丽街道官龙村西82号'
-}
-}
+USER_INPUT = "规划2025-12-25上海到深圳的行程：从上海市浦东新区川沙新镇黄赵路310号出发，会议地址是深圳市南山区桃园路2号，开始时间是2025-12-25 16:00，开一小时。酒店是深圳市南山区西丽街道官龙村西82号，"
 
 
-def run_planner():
-    # 编译图结构
-    app = build_travel_graph().compile()
-    INITIAL_INPUT['user_data'] = llm_parse_user_input("规划2025-12-25上海到深圳的行程：从上海市浦东新区川沙新镇黄赵路310号出发，会议地址是深圳市南山区桃园路2号，开始时间是2025-12-25 16:00，开一小时。酒店是深圳市南山区西丽街道官龙村西82号，")
+def setup_logging(level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """
+    日志经 QueueHandler 入队，由 QueueListener 后台线程统一写出，
+    避免评分等并发线程在 stdout 上相互阻塞。
+    """
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
 
-    print("--- ✈️ 行程规划助手启动 ---")
-    print(
-        f"初始输入: {INITIAL_INPUT['user_data']['origin_city']} -> {INITIAL_INPUT['user_data']['destination_city']} ({INITIAL_INPUT['user_data']['departure_date']})")
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
 
-    # 1. 预处理用户数据：将时间字符串转换为 datetime 对象
-    user_data = INITIAL_INPUT['user_data'].copy()
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
 
-    # 核心修正：将 'meeting_start' 字符串解析为 datetime 对象
-    meeting_start_str = user_data['meeting_start']
-    meeting_start_dt = datetime.strptime(meeting_start_str, "%Y-%m-%d %H:%M")
 
-    # 将 datetime 对象存入状态，供后续节点使用
-    user_data['meeting_start_dt'] = meeting_start_dt
+def run_planner():
+    # 复用模块级已编译的图结构
+    app = COMPILED_GRAPH
 
-    # 2. 初始化 Graph 状态
-    initial_state = TravelPlanState(user_data=user_data)
+    print("--- ✈️ 行程规划助手启动 ---")
+    print(f"初始输入: {USER_INPUT}")
+
+    # 1. 初始化 Graph 状态：原始文本交给节点 1 (check_constraints) 解析，
+    #    meeting_start 由 UserInputParams 直接转换为 datetime，无需在此重复解析
+    initial_state = TravelPlanState(user_input=USER_INPUT)
 
-    # 3. 运行图
+    # 2. 运行图
     try:
         # 使用 .invoke() 运行
         final_state = app.invoke(initial_state, config={"recursion_limit": 10})
@@ -79,7 +78,7 @@ def run_planner():
     meeting_start_dt = final_state.get('user_data', {}).get('meeting_start_dt')
 
     print("\n**【节点 1, 2, 3 结果】**")
-    print(f"   - 会议开始时间: {meeting_start_dt.strftime('%Y-%m-%d %H:%M') if meeting_start_dt else 'N/A'}")
+    print(f"   - 会议开始时间: {meeting_start_dt.isoformat(sep=' ', timespec='minutes') if meeting_start_dt else 'N/A'}")
     print(
         f"   - 交通选项数量: {len(final_state.get('flight_options', [])) + len(final_state.get('train_options', []))}")
     print("-" * 30)
@@ -94,11 +93,11 @@ def run_planner():
 
         print(f"       > 类型/ID: {selected['description']}")
         print(
-            f"       > 班次时间: {departure_dt.strftime('%H:%M')} (起飞/发车) -> {selected['end_time'].strftime('%H:%M')} (到达)")
+            f"       > 班次时间: {format_hhmm(departure_dt)} (起飞/发车) -> {format_hhmm(selected['end_time'])} (到达)")
         print(f"       > 价格: {commute_info.get('price', 'N/A')} 元")
-        print(f"       > 需在 {actual_start_time.strftime('%H:%M')} 从家出发 (含缓冲)。")
+        print(f"       > 需在 {format_hhmm(actual_start_time)} 从家出发 (含缓冲)。")
         print(
-            f"       > 预估到达会议地时间: {actual_arrival.strftime('%H:%M') if actual_arrival else 'N/A'} (远早于会议开始时间)。")
+            f"       > 预估到达会议地时间: {format_hhmm(actual_arrival) if actual_arrival else 'N/A'} (远早于会议开始时间)。")
         print(f"       > 到达枢纽: {selected['location']['name']}")
 
     else:
@@ -143,4 +142,8 @@ def run_planner():
 
 
 if __name__ == "__main__":
-    run_planner()
\ No newline at end of file
+    log_listener = setup_logging()
+    try:
+        run_planner()
+    finally:
+        log_listener.stop()
\ No newline at end of file
@@ -1,12 +1,28 @@
 # nodes.py
-from typing import Dict, Any, List
+import heapq
+import logging
+from operator import itemgetter
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
-from config import POST_ARRIVAL_BUFFER_MINUTES, COMPANY_VISIT_DURATION_MINUTES
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from config import POST_ARRIVAL_BUFFER_MINUTES, COMPANY_VISIT_DURATION_MINUTES, EDGE_PREFETCH_TOP_K
 from llm_agent import llm_choose_transport, llm_plan_route_pre_meeting, get_final_report_by_llm, \
-    get_company_scores_by_llm, llm_parse_user_input
+    get_company_scores_by_llm, llm_parse_user_input, LLMUnavailable, PRE_MEETING_BUFFER_MINUTES, format_hhmm
 from planning_tools import filter_companies_by_area_by_time, plan_multi_company_visit
 from state import TravelPlanState, Location, ItineraryItem
-from api_tools import query_flight_api, query_train_api, amap_geocode, get_amap_driving_time
+from api_tools import query_transport_options, amap_geocode_batch, get_amap_driving_time, \
+    get_amap_driving_time_batch, prefetch_hub_geocodes, parse_ymdhm, build_time_matrix
+
+logger = logging.getLogger(__name__)
+
+
+def _hub_location(city_loc: Location, hub_name: str, coords: Dict[str, float]) -> Location:
+    """
+    以城市所在 Location 为模板构造枢纽 Location（名称/地址替换为枢纽名，坐标替换为枢纽坐标）。
+    每次调用返回新字典：Location 会写入状态与行程条目，跨会话共享同一对象会互相影响。
+    """
+    return {**city_loc, 'address': hub_name, 'name': hub_name, **coords}
 
 
 def check_constraints(state: TravelPlanState) -> Dict[str, Any]:
@@ -15,7 +31,12 @@ def check_constraints(state: TravelPlanState) -> Dict[str, Any]:
     检查用户输入是否完整、日期时间格式是否正确，并初始化 Location 结构。
     """
     user_input = state['user_input']
-    user_data = llm_parse_user_input(user_input)
+    try:
+        user_data = llm_parse_user_input(user_input)
+    except LLMUnavailable as e:
+        return {"error_message": f"LLM 服务暂不可用，无法解析行程需求: {e}"}
+    if 'error_message' in user_data:
+        return {"error_message": user_data['error_message']}
     # 1. 检查关键信息完整性
     required_keys = ['origin_city', 'destination_city', 'departure_date',
                      'meeting_start', 'meeting_duration_h', 'home_address', 'meeting_address',
@@ -26,8 +47,8 @@ def check_constraints(state: TravelPlanState) -> Dict[str, Any]:
         return {"error_message": f"缺少关键输入信息: {', '.join(missing_keys)}"}
 
     try:
-        # 2. 校验时间格式并转换为 datetime 对象
-        meeting_start_dt = datetime.strptime(user_data['meeting_start'], '%Y-%m-%d %H:%M')
+        # 2. meeting_start 已由 UserInputParams 解析为 datetime 对象（格式错误在解析阶段即返回提示）
+        meeting_start_dt = user_data['meeting_start']
 
         # 3. 初始化 Location 结构
         home_location: Location = {
@@ -51,6 +72,8 @@ def check_constraints(state: TravelPlanState) -> Dict[str, Any]:
 
         # 4. 更新 state
         user_data['meeting_start_dt'] = meeting_start_dt
+        # 预先格式化，供后续 LLM 输入直接使用
+        user_data['meeting_start_str'] = meeting_start_dt.isoformat(sep=' ', timespec='minutes')
 
         return {
             "user_data": user_data,
@@ -60,8 +83,6 @@ def check_constraints(state: TravelPlanState) -> Dict[str, Any]:
             "error_message": None
         }
 
-    except ValueError:
-        return {"error_message": "日期或时间格式不正确，请使用 YYYY-MM-DD HH:MM 格式。"}
     except Exception as e:
         return {"error_message": f"初始化校验过程中发生未知错误: {e}"}
 
@@ -79,15 +100,11 @@ def geocode_locations(state: TravelPlanState) -> Dict[str, Any]:
     hotel_loc = state['hotel_location']
 
     locations_to_update = [home_loc, meeting_loc, hotel_loc]
-    updated_locations = {}
-
-    for loc in locations_to_update:
-        address = loc['address']
-        city = loc['city']
 
-        # 调用地理编码工具
-        coords = amap_geocode(address, city)
+    # 三个地址互不依赖，并发调用地理编码工具
+    all_coords = amap_geocode_batch([(loc['address'], loc['city']) for loc in locations_to_update])
 
+    for loc, coords in zip(locations_to_update, all_coords):
         if coords:
             loc['lat'] = coords['lat']
             loc['lon'] = coords['lon']
@@ -116,19 +133,13 @@ def traffic_query(state: TravelPlanState) -> Dict[str, Any]:
     destination = state['meeting_location']['city']
 
     meeting_start_dt = user_data['meeting_start_dt']
-    target_date = meeting_start_dt.strftime('%Y-%m-%d')
-    previous_date = (meeting_start_dt - timedelta(days=1)).strftime('%Y-%m-%d')
+    target_date = meeting_start_dt.date().isoformat()
+    previous_date = (meeting_start_dt - timedelta(days=1)).date().isoformat()
 
     print(f"\n--- 🚅 节点 3: 交通查询开始 ({origin} -> {destination}) ---")
 
-    # 1. 航班查询
-    flight_options_target = query_flight_api(origin, destination, target_date)
-    flight_options_prev = query_flight_api(origin, destination, previous_date)
-    flight_options = flight_options_prev + flight_options_target
-    # 2. 高铁查询
-    train_options_target = query_train_api(origin, destination, target_date)
-    train_options_prev = query_train_api(origin, destination, previous_date)
-    train_options = train_options_prev + train_options_target
+    # 1. 航班与高铁并发查询 (前一天 + 会议当天，四个请求同时发出)
+    flight_options, train_options = query_transport_options(origin, destination, previous_date, target_date)
 
     total_count = len(flight_options) + len(train_options)
 
@@ -138,6 +149,13 @@ def traffic_query(state: TravelPlanState) -> Dict[str, Any]:
 
     print(f"✅ 查询完成。共找到 {total_count} 个交通选项。")
 
+    # 2. 在后台预先地理编码所有枢纽，节点 4/5 查询参考枢纽和选定枢纽时可直接命中缓存
+    hub_pairs = []
+    for opt in flight_options + train_options:
+        hub_pairs.append((opt.departure_hub, origin))
+        hub_pairs.append((opt.arrival_hub, destination))
+    prefetch_hub_geocodes(hub_pairs)
+
     return {
         "flight_options": flight_options,
         "train_options": train_options,
@@ -167,37 +185,49 @@ def select_transport_by_llm(state: TravelPlanState) -> Dict[str, Any]:
     # --- GeoCode 参考枢纽以计算参考通勤时间 ---
     ref_option = transport_options[0]
 
-    # GeoCode 参考出发枢纽
-    ref_dep_hub_name = ref_option['departure_hub']
-    ref_dep_coords = amap_geocode(ref_dep_hub_name, home_loc['city'])
+    # 并发 GeoCode 参考出发枢纽和到达枢纽
+    ref_dep_hub_name = ref_option.departure_hub
+    ref_arr_hub_name = ref_option.arrival_hub
+    ref_dep_coords, ref_arr_coords = amap_geocode_batch([
+        (ref_dep_hub_name, home_loc['city']),
+        (ref_arr_hub_name, meeting_loc['city']),
+    ])
     if not ref_dep_coords:
         return {"error_message": f"无法对出发枢纽 '{ref_dep_hub_name}' 进行地理编码，流程终止。"}
-
-    # GeoCode 参考到达枢纽
-    ref_arr_hub_name = ref_option['arrival_hub']
-    ref_arr_coords = amap_geocode(ref_arr_hub_name, meeting_loc['city'])
     if not ref_arr_coords:
         return {"error_message": f"无法对到达枢纽 '{ref_arr_hub_name}' 进行地理编码，流程终止。"}
 
-    # 构造包含坐标的 Location 结构（**是解包操作，而'address': ref_dep_hub_name, 'name': ref_dep_hub_name会对前面解包后的键值进行覆盖）
-    ref_origin_hub_loc: Location = {**home_loc, 'address': ref_dep_hub_name, 'name': ref_dep_hub_name, **ref_dep_coords}
-    ref_arrival_hub_loc: Location = {**meeting_loc, 'address': ref_arr_hub_name, 'name': ref_arr_hub_name, **ref_arr_coords}
+    # 构造包含坐标的 Location 结构
+    ref_origin_hub_loc = _hub_location(home_loc, ref_dep_hub_name, ref_dep_coords)
+    ref_arrival_hub_loc = _hub_location(meeting_loc, ref_arr_hub_name, ref_arr_coords)
 
-    # 计算参考通勤时间
-    home_commute_minutes = get_amap_driving_time(home_loc, ref_origin_hub_loc)
+    # 并发计算参考通勤时间
+    home_commute_minutes, arrival_commute_minutes = get_amap_driving_time_batch([
+        (home_loc, ref_origin_hub_loc),
+        (ref_arrival_hub_loc, meeting_loc),
+    ])
     home_commute_minutes = home_commute_minutes if home_commute_minutes is not None else 60.0
-    arrival_commute_minutes = get_amap_driving_time(ref_arrival_hub_loc, meeting_loc)
     arrival_commute_minutes = arrival_commute_minutes if arrival_commute_minutes is not None else 60.0
 
     print(f"   -> 参考通勤时间：{home_commute_minutes:.1f} (家->枢纽) / {arrival_commute_minutes:.1f} (枢纽->会议地)")
 
+    # 最晚需在会议前 (90分钟 + 枢纽通勤时间) 到达枢纽；通勤时间在此才确定，故在节点内一次性算好
+    latest_hub_arrival_dt = user_data['meeting_start_dt'] - timedelta(
+        minutes=PRE_MEETING_BUFFER_MINUTES + arrival_commute_minutes)
+    latest_hub_arrival_str = latest_hub_arrival_dt.isoformat(sep=' ', timespec='minutes')
+
     # 2. 调用 DeepSeek LLM 决策
-    selected_option_dict = llm_choose_transport(
-        transport_options,
-        user_data,
-        home_commute_minutes,
-        arrival_commute_minutes
-    )
+    # 参考通勤时间取整到分钟再传入：对决策没有影响，但路况的小幅波动不会让 LLM 缓存失效
+    try:
+        selected_option_dict = llm_choose_transport(
+            transport_options,
+            user_data,
+            round(home_commute_minutes),
+            round(arrival_commute_minutes),
+            latest_hub_arrival_str
+        )
+    except LLMUnavailable as e:
+        return {"error_message": f"LLM 服务暂不可用，无法选择交通班次: {e}"}
 
     if not selected_option_dict or 'departure_time' not in selected_option_dict:
         return {"error_message": "LLM未返回有效或完整的交通选择。"}
@@ -232,10 +262,10 @@ def calculate_final_transport(state: TravelPlanState) -> Dict[str, Any]:
 
         # 完整的出发/到达日期
         departure_date = user_data['departure_date']
-        start_time_dt = datetime.strptime(f"{departure_date} {departure_time_str}", '%Y-%m-%d %H:%M')
+        start_time_dt = parse_ymdhm(f"{departure_date} {departure_time_str}")
 
         # 💡 注意：跨天交通（例如夜车或长途航班）需要特殊处理，这里简化为默认在同一天
-        end_time_dt = datetime.strptime(f"{departure_date} {arrival_time_str}", '%Y-%m-%d %H:%M')
+        end_time_dt = parse_ymdhm(f"{departure_date} {arrival_time_str}")
         if end_time_dt < start_time_dt:
             end_time_dt += timedelta(days=1)
 
@@ -249,26 +279,26 @@ def calculate_final_transport(state: TravelPlanState) -> Dict[str, Any]:
     home_city = home_loc['city']
     meeting_city = meeting_loc['city']
 
-    dep_hub_coords = amap_geocode(dep_hub_name, home_city)
-    arr_hub_coords = amap_geocode(arr_hub_name, meeting_city)
-
-    # 🔍 优化 GeoCode 查询：如果失败，尝试加上“站”后缀
-    if not dep_hub_coords and not dep_hub_name.endswith('站'):
-        dep_hub_coords = amap_geocode(f"{dep_hub_name}站", home_city)
-
-    if not arr_hub_coords and not arr_hub_name.endswith('站'):
-        arr_hub_coords = amap_geocode(f"{arr_hub_name}站", meeting_city)
+    # 🔍 并发 GeoCode 两个枢纽：如果失败，尝试加上“站”后缀（成功的后缀结果会回填原名缓存）
+    dep_hub_coords, arr_hub_coords = amap_geocode_batch([
+        (dep_hub_name, home_city),
+        (arr_hub_name, meeting_city),
+    ], hub_fallback=True)
 
     if not dep_hub_coords or not arr_hub_coords:
         return {"error_message": "交通精确计算失败：无法对选定班次的枢纽进行地理编码。"}
 
     # 3. 构造 Location 结构进行精确路径规划
-    dep_hub_loc: Location = {**home_loc, 'address': dep_hub_name, 'name': dep_hub_name, **dep_hub_coords}
-    arr_hub_loc: Location = {**meeting_loc, 'address': arr_hub_name, 'name': arr_hub_name, **arr_hub_coords}
+    dep_hub_loc = _hub_location(home_loc, dep_hub_name, dep_hub_coords)
+    arr_hub_loc = _hub_location(meeting_loc, arr_hub_name, arr_hub_coords)
 
-    # 4. 计算精确通勤时间 (家->枢纽, 枢纽->会议地)
-    home_commute_minutes = get_amap_driving_time(home_loc, dep_hub_loc) or 60.0
-    arrival_commute_minutes = get_amap_driving_time(arr_hub_loc, meeting_loc) or 60.0
+    # 4. 并发计算精确通勤时间 (家->枢纽, 枢纽->会议地)
+    home_commute_minutes, arrival_commute_minutes = get_amap_driving_time_batch([
+        (home_loc, dep_hub_loc),
+        (arr_hub_loc, meeting_loc),
+    ])
+    home_commute_minutes = home_commute_minutes or 60.0
+    arrival_commute_minutes = arrival_commute_minutes or 60.0
 
     print(f"\n--- ⏱️ 节点 5: 交通精确计算 ---")
     print(f"   -> 选定班次: {selected_option_raw['id']} ({selected_option_raw['type']})")
@@ -306,10 +336,36 @@ def calculate_final_transport(state: TravelPlanState) -> Dict[str, Any]:
 
 
 
+def _prefetch_company_edges(companies: List[Dict[str, Any]],
+                            available_minutes: float) -> Optional[Tuple[List[Dict[str, Any]], np.ndarray]]:
+    """
+    预取候选企业两两之间的驾车时间矩阵，返回 (候选企业列表, 与之下标对齐的矩阵)；无需预取时返回 None。
+    枢纽->企业、企业->会议地已在可行性筛选时查过；可用时间不够拜访两家企业时无需企业间的边。
+    候选取时间余量最大的 EDGE_PREFETCH_TOP_K 家，控制预取的请求数。
+    """
+    if available_minutes < 2 * COMPANY_VISIT_DURATION_MINUTES:
+        return None
+    candidates = sorted(companies, key=itemgetter('T_buffer'), reverse=True)[:EDGE_PREFETCH_TOP_K]
+    return candidates, build_time_matrix([c['location'] for c in candidates])
+
+
+def _align_prefetched_matrix(companies: List[Dict[str, Any]],
+                             prefetched: Optional[Tuple[List[Dict[str, Any]], np.ndarray]]) -> Optional[np.ndarray]:
+    """预取的矩阵覆盖全部待规划企业时，按 companies 的顺序重排后返回；否则返回 None，由排程只为入选企业查询。"""
+    if prefetched is None:
+        return None
+    candidates, matrix = prefetched
+    position = {id(c): i for i, c in enumerate(candidates)}
+    order = [position.get(id(c)) for c in companies]
+    if None in order:
+        return None
+    return matrix[np.ix_(order, order)]
+
+
 def pre_meeting_plan(state: TravelPlanState) -> Dict[str, Any]:
     """
     节点 6: 会议前行程规划。
-    使用混合评分（LLM吸引力/可行性 + 时间成本）和贪婪算法进行多企业调研规划。
+    使用混合评分（LLM吸引力/可行性 + 时间成本）和背包 DP 选择进行多企业调研规划。
     并实现【简单粗暴的截断回退机制】。
     """
     print("\n--- 🧭 节点 6: 会议前行程规划开始 ---")
@@ -339,8 +395,8 @@ def pre_meeting_plan(state: TravelPlanState) -> Dict[str, Any]:
     time_window_available = latest_arrival_needed - arrival_at_hub_dt
     available_minutes = time_window_available.total_seconds() / 60
 
-    print(f"   -> 枢纽到达时间: {arrival_at_hub_dt.strftime('%H:%M')}")
-    print(f"   -> 最晚需到达时间: {latest_arrival_needed.strftime('%H:%M')} (含 {POST_ARRIVAL_BUFFER_MINUTES}min 缓冲)")
+    print(f"   -> 枢纽到达时间: {format_hhmm(arrival_at_hub_dt)}")
+    print(f"   -> 最晚需到达时间: {format_hhmm(latest_arrival_needed)} (含 {POST_ARRIVAL_BUFFER_MINUTES}min 缓冲)")
     print(f"   -> 规划可用空闲时间: {available_minutes:.1f} 分钟")
 
     # 3. 企业筛选和时间成本计算 (与原逻辑保持一致)
@@ -353,61 +409,91 @@ def pre_meeting_plan(state: TravelPlanState) -> Dict[str, Any]:
     print(f"🌍 正在对 {len(first_filtered_companies)} 家潜在企业进行基于时间的精确筛选...")
     available_companies = []
 
-    # 3b. 二次筛选：计算完整行程时间并检查可行性
+    # 3b. 二次筛选：一次性并发查询 枢纽->企业 与 企业->会议地 的驾车时间
+    driving_pairs = []
     for company in first_filtered_companies:
-        company_loc = company['location']
-        T_hub_to_i = get_amap_driving_time(arrival_hub_loc, company_loc)
-        T_i_to_meeting = get_amap_driving_time(company_loc, meeting_loc)  # 修正：这里不再有 ['location']
-
+        driving_pairs.append((arrival_hub_loc, company['location']))
+        driving_pairs.append((company['location'], meeting_loc))
+    driving_times = get_amap_driving_time_batch(driving_pairs)
+
+    # 计算完整行程时间并检查可行性：扣除调研时长后的驾车预算只算一次，
+    # 循环内只比较两段驾车时间之和
+    driving_budget = available_minutes - COMPANY_VISIT_DURATION_MINUTES
+    hub_times = driving_times[0::2]
+    meeting_times = driving_times[1::2]
+    for company, T_hub_to_i, T_i_to_meeting in zip(first_filtered_companies, hub_times, meeting_times):
         if T_hub_to_i is None or T_i_to_meeting is None:
             continue
 
-        time_needed_for_visit = T_hub_to_i + COMPANY_VISIT_DURATION_MINUTES + T_i_to_meeting
-
-        if time_needed_for_visit <= available_minutes:
+        T_total_trip = T_hub_to_i + T_i_to_meeting
+        if T_total_trip <= driving_budget:
             company['T_hub_to_i'] = T_hub_to_i
             company['T_i_to_meeting'] = T_i_to_meeting
-            company['T_total_trip'] = T_hub_to_i + T_i_to_meeting
+            company['T_total_trip'] = T_total_trip
             # ❗ T_buffer 是关键的可行性指标，必须计算
-            company['T_buffer'] = available_minutes - time_needed_for_visit
+            company['T_buffer'] = driving_budget - T_total_trip
             available_companies.append(company)
-            print(f"   -> ✅ 纳入 {company['name']} (总耗时: {time_needed_for_visit:.1f} min)")
+            logger.debug("   -> ✅ 纳入 %s (总耗时: %.1f min)", company['name'],
+                         T_total_trip + COMPANY_VISIT_DURATION_MINUTES)
 
     if not available_companies:
         print("⚠️ 未找到顺路且时间可行的调研企业。")
         return {"pre_meeting_route": pre_meeting_route_final, "error_message": None}
 
     # 4. 混合评分和贪婪规划 (与原逻辑保持一致)
+    # LLM 评分耗时数秒，期间并发预取企业间驾车时间矩阵，供排程直接使用，截断回退阶段也可命中缓存
     print(f"🌍 正在对 {len(available_companies)} 家企业进行 LLM 智能评分...")
-    scored_companies_llm_output = get_company_scores_by_llm(available_companies, available_minutes)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        prefetch_future = executor.submit(_prefetch_company_edges, available_companies, available_minutes)
+        try:
+            scored_companies_llm_output = get_company_scores_by_llm(available_companies, available_minutes)
+        except LLMUnavailable as e:
+            # 评分是可选环节：LLM 不可用时降级为无会前调研，主流程继续
+            print(f"⚠️ {e}，跳过会议前调研。")
+            scored_companies_llm_output = []
     if not scored_companies_llm_output:
         print("❌ LLM 评分阶段失败，本次行程无会议前调研。")
         return {"pre_meeting_route": pre_meeting_route_final, "error_message": None}
 
     # 4b. 数据合并/回填 (确保数据结构完整)
+    # available_companies 已是筛选阶段拷贝出的独立对象，评分直接原地写入，无需逐个再复制；
+    # pop 保证 LLM 重复返回同一企业时只合并一次
     merged_companies_for_planning = []
-    original_companies_map = {c['name']: c for c in available_companies}
+    companies_by_name = {c['name']: c for c in available_companies}
     for scored_item in scored_companies_llm_output:
-        company_name = scored_item['name']
-        original_data = original_companies_map.get(company_name)
-        if original_data:
-            merged_item = original_data.copy()
-            merged_item.update(scored_item)
-            try:
-                merged_item['S_attract'] = float(merged_item['S_attract'])
-                merged_item['S_feas'] = float(merged_item['S_feas'])
-                merged_companies_for_planning.append(merged_item)
-            except (ValueError, TypeError):
-                print(f"⚠️ 警告：企业 {company_name} 的 LLM 评分数据格式不正确，跳过。")
-
-    # 4c. 贪婪规划 (获取按 S_final 降序排序的完整序列)
-    print("🧠 正在使用混合评分和贪婪算法进行多企业规划...")
+        company_name = scored_item.get('name')
+        company = companies_by_name.pop(company_name, None)
+        if company is None:
+            continue
+        try:
+            S_attract = float(scored_item['S_attract'])
+            S_feas = float(scored_item['S_feas'])
+        except (KeyError, ValueError, TypeError):
+            print(f"⚠️ 警告：企业 {company_name} 的 LLM 评分数据格式不正确，跳过。")
+            continue
+        company.update(scored_item)
+        company['S_attract'] = S_attract
+        company['S_feas'] = S_feas
+        merged_companies_for_planning.append(company)
+
+    # 4c. 背包选择 + 排程 (获取按最短驾车顺序排列的入选企业序列)
+    # 预取的企业间矩阵与筛选阶段的 枢纽->企业 时间直接交给排程，覆盖全部企业时不再查询高德
+    try:
+        time_matrix = _align_prefetched_matrix(merged_companies_for_planning, prefetch_future.result())
+    except Exception as e:
+        logger.debug("企业间驾车时间预取失败，排程时重新查询: %s", e)
+        time_matrix = None
+    hub_row = np.array([c['T_hub_to_i'] for c in merged_companies_for_planning], dtype=np.float64)
+
+    print("🧠 正在使用混合评分和背包 DP进行多企业规划...")
     final_visit_plan_data = plan_multi_company_visit(
         merged_companies_for_planning,
         available_minutes,
         arrival_at_hub_dt,
         arrival_hub_loc,
-        meeting_loc
+        meeting_loc,
+        time_matrix=time_matrix,
+        hub_row=hub_row
     )
 
     if not final_visit_plan_data:
@@ -416,100 +502,96 @@ def pre_meeting_plan(state: TravelPlanState) -> Dict[str, Any]:
 
     print(f"✅ LLM/混合评分成功规划 {len(final_visit_plan_data)} 个调研企业。")
 
-    # --- 5. 简单粗暴的【截断回退】循环 ---
+    # --- 5. 截断回退：先一次性并发取齐所有边，再在内存中寻找最大可行前缀 ---
     print("--- 🔄 开始截断回退，寻找最大可行子集 ---")
 
+    # 访问顺序固定，截断只会去掉末尾企业，因此只需要：
+    #   legs[i]      = 上一个点 (枢纽或第 i-1 家企业) -> 第 i 家企业
+    #   last_hops[i] = 第 i 家企业 -> 会议地点 (截断到 i+1 家企业时的最后一段)
+    plan_locs = [visit_item['location'] for visit_item in final_visit_plan_data]
+    prev_locs = [arrival_hub_loc] + plan_locs[:-1]
+    edge_times = get_amap_driving_time_batch(
+        list(zip(prev_locs, plan_locs)) + [(loc, meeting_loc) for loc in plan_locs]
+    )
+    legs = edge_times[:len(plan_locs)]
+    last_hops = edge_times[len(plan_locs):]
+
+    # 内部路线中断时，只能保留中断点之前的企业
+    if None in legs:
+        broken_at = legs.index(None)
+        for removed_company in final_visit_plan_data[broken_at:]:
+            logger.debug("❌ 内部路线规划中断，移除企业: %s。", removed_company['name'])
+        del final_visit_plan_data[broken_at:]
+
     while final_visit_plan_data:
+        k = len(final_visit_plan_data)
+        final_commute_min = last_hops[k - 1]
 
-        current_loc = arrival_hub_loc
-        current_time = arrival_at_hub_dt
-        current_route_items: List[ItineraryItem] = []  # 用于本次循环的检查
-        all_routes_planned = True
+        if final_commute_min is None:
+            removed_company = final_visit_plan_data.pop()
+            logger.debug("❌ 警告：无法获取最后一个企业到会议地点的路线。移除企业: %s。", removed_company['name'])
+            continue
 
-        # 5a. 临时构建路由并计算到达时间
-        for i, visit_item in enumerate(final_visit_plan_data):
+        visits_end_dt = arrival_at_hub_dt + timedelta(
+            minutes=sum(legs[:k]) + COMPANY_VISIT_DURATION_MINUTES * k)
+        candidate_arrival_time = visits_end_dt + timedelta(minutes=final_commute_min)
+
+        if candidate_arrival_time <= latest_arrival_needed:
+            print(
+                f"✅ 找到最大可行行程，共 {k} 个企业。最终到达时间: {format_hhmm(candidate_arrival_time)}。")
+            break
+
+        # 行程不可行，移除最后访问的企业，重新检查
+        removed_company = final_visit_plan_data.pop()
+        logger.debug(
+            "❌ 行程不可行 (到达 %02d:%02d 晚于 %02d:%02d)，移除最后访问企业: %s。尝试 %d 个企业。",
+            candidate_arrival_time.hour, candidate_arrival_time.minute,
+            latest_arrival_needed.hour, latest_arrival_needed.minute,
+            removed_company['name'], len(final_visit_plan_data)
+        )
+
+    # 5b. 为最大可行前缀构建行程条目
+    if final_visit_plan_data:
+        current_time = arrival_at_hub_dt
+        for visit_item, T_prev_to_i in zip(final_visit_plan_data, legs):
             company_name = visit_item['name']
             company_loc = visit_item['location']
 
             # 1. 交通段：上一个点 -> 当前企业
-            T_prev_to_i = get_amap_driving_time(current_loc, company_loc)
-
-            if T_prev_to_i is None:
-                all_routes_planned = False
-                break
-
-            travel_start_dt = current_time
-            travel_end_dt = travel_start_dt + timedelta(minutes=T_prev_to_i)
-
-            # 存储交通段
-            current_route_items.append({
+            travel_end_dt = current_time + timedelta(minutes=T_prev_to_i)
+            pre_meeting_route_final.append({
                 'type': 'transport',
                 'description': f"驾车前往调研企业 {company_name}",
-                'start_time': travel_start_dt,
+                'start_time': current_time,
                 'end_time': travel_end_dt,
                 'location': company_loc,
                 'details': {'duration_min': T_prev_to_i}
             })
 
             # 2. 活动段：企业调研
-            visit_start_dt = travel_end_dt
-            visit_end_dt = visit_start_dt + timedelta(minutes=COMPANY_VISIT_DURATION_MINUTES)
-
-            # 存储活动段
-            current_route_items.append({
+            visit_end_dt = travel_end_dt + timedelta(minutes=COMPANY_VISIT_DURATION_MINUTES)
+            pre_meeting_route_final.append({
                 'type': 'company_visit',
                 'description': f"企业调研/拜访: {company_name}",
-                'start_time': visit_start_dt,
+                'start_time': travel_end_dt,
                 'end_time': visit_end_dt,
                 'location': company_loc,
                 'details': {'company_name': company_name}
             })
 
-            # 3. 更新状态
             current_time = visit_end_dt
-            current_loc = company_loc
-
-        # 5b. 最终交通段：最后一个活动地点 -> 会议地点 (检查可行性)
-        if not all_routes_planned:
-            # 移除得分最低的企业并重新尝试
-            removed_company = final_visit_plan_data.pop()
-            print(f"❌ 内部路线规划中断，移除得分最低企业: {removed_company['name']}。")
-            continue
-
-        final_commute_min = get_amap_driving_time(current_loc, meeting_loc)
-
-        if final_commute_min is None:
-            removed_company = final_visit_plan_data.pop()
-            print(f"❌ 警告：无法获取最后一个企业到会议地点的路线。移除企业: {removed_company['name']}。")
-            continue
 
+        # 3. 最终交通段：最后一个企业 -> 会议地点
+        final_commute_min = last_hops[len(final_visit_plan_data) - 1]
         final_arrival_time = current_time + timedelta(minutes=final_commute_min)
-
-        # 5c. 检查可行性
-        if final_arrival_time <= latest_arrival_needed:
-            # 行程可行！添加最后的交通段并保存
-
-            current_route_items.append({
-                'type': 'transport',
-                'description': "驾车前往会议地点",
-                'start_time': current_time,
-                'end_time': final_arrival_time,
-                'location': meeting_loc,
-                'details': {'duration_min': final_commute_min}
-            })
-
-            pre_meeting_route_final = current_route_items  # 保存最终可行路由
-
-            print(
-                f"✅ 找到最大可行行程，共 {len(final_visit_plan_data)} 个企业。最终到达时间: {final_arrival_time.strftime('%H:%M')}。")
-            break  # 退出 while 循环
-        else:
-            # 行程不可行，移除得分最低的（最后一个）企业，重新循环
-            removed_company = final_visit_plan_data.pop()
-            print(
-                f"❌ 行程不可行 (到达 {final_arrival_time.strftime('%H:%M')} 晚于 {latest_arrival_needed.strftime('%H:%M')})，"
-                f"移除得分最低企业: {removed_company['name']}。尝试 {len(final_visit_plan_data)} 个企业。"
-            )
+        pre_meeting_route_final.append({
+            'type': 'transport',
+            'description': "驾车前往会议地点",
+            'start_time': current_time,
+            'end_time': final_arrival_time,
+            'location': meeting_loc,
+            'details': {'duration_min': final_commute_min}
+        })
 
     # 6. 如果循环结束，final_visit_plan_data 为空
     if not pre_meeting_route_final:
@@ -522,7 +604,7 @@ def pre_meeting_plan(state: TravelPlanState) -> Dict[str, Any]:
         final_arrival_time = arrival_at_hub_dt + timedelta(minutes=arrival_commute_min)
 
     print(f"✅ 会议前规划完成，共生成 {len(pre_meeting_route_final)} 个行程条目。")
-    print(f"   -> 最终到达会议地时间: {final_arrival_time.strftime('%H:%M')}")
+    print(f"   -> 最终到达会议地时间: {format_hhmm(final_arrival_time)}")
 
     return {
         "pre_meeting_route": pre_meeting_route_final,
@@ -595,11 +677,12 @@ def post_meeting_plan(state: TravelPlanState) -> Dict[str, Any]:
     })
 
     print(f"✅ 会议后规划完成，共生成 {len(post_meeting_route)} 个行程条目。")
-    print(f"   -> 预计入住时间: {arrival_at_hotel_dt.strftime('%H:%M')}")
+    print(f"   -> 预计入住时间: {format_hhmm(arrival_at_hotel_dt)}")
 
+    # 本节点与 pre_meeting_plan 在同一步并行执行，只写入自己的状态键，
+    # 不写 error_message，避免同一步内对同一个键的重复更新
     return {
         "post_meeting_route": post_meeting_route,
-        "error_message": None
     }
 
 
@@ -610,24 +693,21 @@ def generate_final_itinerary(state: TravelPlanState) -> Dict[str, Any]:
     print("\n--- 📝 节点 6: 生成最终行程报告开始 ---")
 
     # 1. 整合所有行程条目
-    itinerary_items: List[ItineraryItem] = []
-
     # 获取主交通段行程 (通常包含 家->枢纽, 枢纽活动, 主交通)
+    main_route = []
     if state.get('selected_transport'):
         main_route = state['selected_transport']['details'].get('itinerary', [])
-        itinerary_items.extend(main_route)
-
-    # 获取会议前行程 (包含枢纽到第一个调研公司，调研公司之间的交通，最后一个调研公司到会议地点的交通)
-    if state.get('pre_meeting_route'):
-        itinerary_items.extend(state['pre_meeting_route'])
 
-    # 获取会议后行程 (包含会议本身、会议到酒店的交通、酒店入住)
-    if state.get('post_meeting_route'):
-        # 修复点 1：将 state.post_meeting_route 改为 state['post_meeting_route']
-        itinerary_items.extend(state['post_meeting_route'])
+    # 会议前行程 (包含枢纽到第一个调研公司，调研公司之间的交通，最后一个调研公司到会议地点的交通)
+    # 与会议后行程 (包含会议本身、会议到酒店的交通、酒店入住)
+    pre_meeting_route = state.get('pre_meeting_route') or []
+    post_meeting_route = state.get('post_meeting_route') or []
 
-    # 2. 按时间排序所有条目 (重要：确保时间顺序正确)
-    itinerary_items.sort(key=lambda x: x['start_time'])
+    # 2. 按时间合并所有条目 (重要：确保时间顺序正确)
+    # 每段行程在生成时已按时间顺序排列，归并即可，无需整体重新排序
+    itinerary_items: List[ItineraryItem] = list(heapq.merge(
+        main_route, pre_meeting_route, post_meeting_route, key=itemgetter('start_time')
+    ))
 
     print(f"   -> 已整合 {len(itinerary_items)} 个行程条目。")
 
@@ -635,7 +715,8 @@ def generate_final_itinerary(state: TravelPlanState) -> Dict[str, Any]:
     # 修复点 2：将 state.user_data 改为 state['user_data']
     final_report_markdown = get_final_report_by_llm(
         state['user_data'], # <--- **关键修复点**
-        itinerary_items
+        itinerary_items,
+        state.get('selected_transport')
     )
 
     # 4. 返回状态更新
@@ -1,24 +1,18 @@
 # prompts.py (确保使用完整的、结构化的 Prompt)
 
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
 
-from data_models import SelectedTransport, PreMeetingPlanOutput
 
-
-# 定义用于提取信息的 Prompt
+# 定义用于提取信息的 Prompt（只包含固定指令，原始用户输入放在随后的 user 消息中，便于命中前缀缓存）
 INPUT_EXTRACTION_PROMPT = """
-你是一个严谨的行程规划助手，你的任务是从用户提供的原始文本中，精确地提取所有关键的行程参数。
+你是一个严谨的行程规划助手，你的任务是从用户消息提供的原始文本中，精确地提取所有关键的行程参数。
 如果用户没有明确提供某些信息，请尽力根据上下文推断或将其保留为 None（如果模型支持）。
 
-原始用户输入文本:
----
-{user_input}
----
-
 请严格按照提供的 JSON Schema 格式输出提取结果。所有字段都是必需的。
 """
 
+# 固定的目标、约束和输出要求放在 system 消息开头，所有动态数据放在末尾的 human 消息中，
+# 使每次调用的 Prompt 前缀完全一致，可命中 DeepSeek 的上下文硬盘缓存
 TRANSPORT_DECISION_PROMPT = ChatPromptTemplate.from_messages(
     [
         (
@@ -27,38 +21,40 @@ TRANSPORT_DECISION_PROMPT = ChatPromptTemplate.from_messages(
 
             --- 🎯 关键约束与目标 ---
             1. **首要目标：调研时间最大化。** 交通方案的到达枢纽时间（结合选项中的"arrival_date"和"arrival_time"）越早，得分越高。
-            2. **硬性截止时间：** 班次的到达枢纽时间**必须早于** **{latest_hub_arrival}**。任何晚于此时间的选项均不予考虑。
+            2. **硬性截止时间：** 班次的到达枢纽时间**必须早于**用户消息中给出的**最晚枢纽到达时间**。任何晚于此时间的选项均不予考虑。
 
-            --- ⏱️ 目标时间与通勤信息 ---
+            --- 📝 输出要求 ---
+            **推理逻辑：** 你必须先根据“硬性截止时间”过滤掉不合格的选项。然后在剩余的选项中，以调研时间潜力（到达时间最早）为主要指标，结合价格，选出最优方案。
+            输出**仅包含选定班次的 'type' 和 'id'**，以及你的推理理由。
+            """
+        ),
+        (
+            "human",
+            """--- ⏱️ 目标时间与通勤信息 ---
             * 目标会议开始时间: {meeting_start_dt}
             * **硬性截止：最晚枢纽到达时间: {latest_hub_arrival}** (已包含缓冲)
             * 从家到出发枢纽需 {home_commute_time} 分钟。
             * 从到达枢纽到会议地需 {arrival_commute_time} 分钟。
 
-            --- 所有交通选项 (JSON 格式列表) ---
+            --- 所有交通选项 (竖线分隔表格，首行为表头) ---
             {transport_options}
 
-            --- 📝 输出要求 ---
-            **推理逻辑：** 你必须先根据“硬性截止时间”过滤掉不合格的选项。然后在剩余的选项中，以调研时间潜力（到达时间最早）为主要指标，结合价格，选出最优方案。
-            你必须以 JSON 格式输出，**仅包含选定班次的 'type' 和 'id'**，以及你的推理理由。其结构必须严格符合以下 Pydantic Model 的定义:
-            {format_instructions}
-            """
+            请根据上述约束和选项，选择最佳班次，并给出理由。"""
         ),
-        ("human", "请根据上述约束和选项，选择最佳班次，并给出理由。"),
     ]
-).partial(format_instructions=JsonOutputParser(pydantic_object=SelectedTransport).get_format_instructions())
+)
 
 #企业评分提示词
 EVALUATE_SCORE_PROMPT = """
 请扮演一位资深的科技行业投资顾问，你正在为一位高管规划一次出差前的企业调研行程。
 你的任务是根据企业的名称、行业背景以及其行程的时间成本，对每个企业进行评分，以辅助最终的行程决策。
 
-**总可用时间:** {t_available:.1f} 分钟。
-
 **评分维度 (0-10分，10分为最高)：**
 1.  **吸引力评分 (S_attract):** 评估该企业在当前行业中的战略价值、技术创新性、以及拜访的必要性。
 2.  **可行性评分 (S_feas):** 评估该企业在地理上的可达性、是否位于主要科技园集群、以及与其他企业/会议地点顺路的程度。
 
+**总可用时间:** {t_available:.1f} 分钟。
+
 **输入企业列表：**
 {companies_markdown_table}
 
@@ -70,19 +66,18 @@ PRE_MEETING_PLAN_PROMPT = ChatPromptTemplate.from_messages([
     ("system",
      "你是一个智能行程规划优化器。你的目标是在商务人士到达城市后、会议开始前，安排 1-2 个顺路的调研企业。"
      "调研活动默认时长为 {visit_duration_minutes} 分钟。"
-     "**【核心约束】** 最终的行程必须是可行的：**所有活动和交通的总时间不能超过 {available_minutes} 分钟**。"
+     "**【核心约束】** 最终的行程必须是可行的：**所有活动和交通的总时间不能超过用户给出的可用总时间**。"
      "你的决策应基于：**调研价值 (value_score) / 时间成本 (driving_time_min)** 的比值，选择性价比最高的企业。"
-     "**【重要】你必须只输出一个 JSON 对象**，其结构必须严格符合以下 Pydantic Model 的定义: \n{format_instructions}"
      ),
     ("human",
      "当前行程：从 {arrival_hub_name} 到 {meeting_venue_name}。"
      "可用总时间 (从到达枢纽算起): **{available_minutes} 分钟**。\n"
      "从到达站台到会议地点的交通耗时约为 {initial_commute_time} 分钟。\n"
-     "以下是可供选择的、顺路且满足初步时间要求的企业列表：{available_companies}\n"
+     "以下是可供选择的、顺路且满足初步时间要求的企业列表 (竖线分隔表格，首行为表头)：\n{available_companies}\n"
      "**【强制规划指令】**：鉴于您有 {available_minutes} 分钟的充足空闲时间，如果 'available_companies' 列表不为空，**请必须选择至少 1 个企业进行调研**，并根据调研价值(value_score)/时间成本(driving_time_min)原则，选择最优的企业进行排序（最多 2 个）。"
-     "请输出一个包含调研企业名称和建议顺序的 JSON 列表，例如: [{{\"name\": \"创新科技 A\", \"order\": 1}}, {{...}}]。"
+     "请给出调研企业名称和建议顺序。"
      )
-]).partial(format_instructions=JsonOutputParser(pydantic_object=PreMeetingPlanOutput).get_format_instructions())
+])
 
 
 
@@ -1,4 +1,5 @@
 # state.py
+from dataclasses import dataclass
 from typing import TypedDict, List, Dict, Optional, Any
 from datetime import datetime
 
@@ -16,6 +17,21 @@ class Location(TypedDict):
     lon: Optional[float]
 
 
+@dataclass(slots=True, frozen=True)
+class TransportOption:
+    """航班/高铁查询返回的单个班次选项（紧凑的只读结构，需要字典时使用 dataclasses.asdict）"""
+    type: str  # 'Flight' 或 'Train'
+    id: str  # 航班号 / 车次
+    departure_time: str  # 'HH:MM'
+    arrival_time: str  # 'HH:MM'
+    price: Any
+    duration: Any  # 航班为分钟数，高铁为 API 原始字符串
+    departure_hub: str  # 机场 IATA 代码或火车站名
+    arrival_hub: str
+    departure_date: str  # 'YYYY-MM-DD'
+    arrival_date: str  # 'YYYY-MM-DD'
+
+
 class ItineraryItem(TypedDict):
     """行程中的一个活动或交通段"""
     type: str  # 'transport', 'company_visit', 'meeting', 'hotel'
@@ -36,8 +52,8 @@ class TravelPlanState(TypedDict):
     user_input: str
     user_data: Dict[str, Any]
     # 交通查询结果
-    flight_options: List[Dict]
-    train_options: List[Dict]
+    flight_options: List[TransportOption]
+    train_options: List[TransportOption]
 
     # LLM选定的交通方案--原始方案和最终方案
     selected_option_raw: Optional[Dict[str, Any]]